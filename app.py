@@ -4,33 +4,61 @@ from flask import Flask, render_template, request, jsonify, send_file, redirect,
 from werkzeug.utils import secure_filename
 import os
 import asyncio
+import shutil
+import traceback
 from pathlib import Path
 from datetime import datetime
-import json
+import orjson
 import time
 import threading
+import queue
+import re
+from collections import deque
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import webbrowser
 
 # Global lock for Telegram session file access
 telegram_session_lock = threading.Lock()
 
-from config import load_config, save_config, config, WORKSPACE_DIR
-from video import compress_video, get_file_size_gb
-from encryption import encrypt_multiple_files, split_and_encrypt_multiple, decrypt_and_extract, list_archive_contents
-from telegram_archives import fetch_telegram_archives, download_telegram_archive, delete_telegram_archive
+from config import load_config, save_config, config, WORKSPACE_DIR, DEFAULT_CONFIG
+from encryption import (encrypt_multiple_files, split_and_encrypt_multiple, decrypt_and_extract, cached_list_archive_contents, format_size,
+                        archive_multiple_files_no_password, split_archive_no_password, encrypt_file, encrypt_and_split_file,
+                        archive_file_no_password, archive_and_split_file_no_password)
+from parallel_upload import parallel_upload_file, parallel_download_file
+from telegram_archives import fetch_telegram_archives, download_telegram_archive, delete_telegram_archive, is_archive_file
+from telegram_client import get_client, get_shared_client, submit_telegram, run_async, reset_client, delete_session, resolve_destination
+from workers import run_compress
+from video import probe_videos
+from telethon.tl.functions.messages import SendMediaRequest
+from telethon.tl.types import InputMediaUploadedDocument, DocumentAttributeFilename, Channel, InputMessagesFilterDocument
+from mnemonic import Mnemonic
 
 # Suppress Telethon flood wait spam
-import logging
 logging.getLogger('telethon').setLevel(logging.ERROR)
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24).hex()
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024 * 1024  # 50GB max
 
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.flv', '.wmv', '.webm')
+PROBE_MIN_SIZE = 64 * 1024  # Smaller "videos" are thumbnails or stubs, not worth probing
+
+# Patterns used on hot progress/upload paths
+_PCT_RE = re.compile(r'(\d+)%')
+_PART_RE = re.compile(r'\.7z\.(\d+)$')
+_STRIP_PART_RE = re.compile(r'\.7z\.\d+$')
+
+def ojson(obj):
+    """JSON response encoded with orjson, for endpoints polled often"""
+    return Response(orjson.dumps(obj), mimetype='application/json')
+
 # Log file for persistent logging
 LOG_FILE = WORKSPACE_DIR.parent / "dailyarchive.log"
 
 # Setup logging to file
-import logging
 logging.basicConfig(
     level=logging.INFO,
     format='[%(asctime)s] %(message)s',
@@ -51,115 +79,412 @@ def log_message(msg, msg_type='info'):
 
 def add_progress_log(job_id, msg, msg_type='info'):
     """Add log to both progress_logs and log file"""
-    progress_logs[job_id].append({'msg': msg, 'type': msg_type})
+    entry = {'msg': msg, 'type': msg_type}
+    with _progress_log_lock, _state_lock:
+        progress_logs[job_id].append(entry)
+        _progress_log_seq[job_id] = _progress_log_seq.get(job_id, 0) + 1
+        progress_append({'op': 'log', 'job': job_id, 'entry': entry})
+    with _progress_cond:
+        _progress_cond.notify_all()
     log_message(msg, msg_type)
 
-# Progress storage file
+def set_progress(key, value):
+    """Update progress state for a job and record the change"""
+    with _progress_log_lock, _state_lock:
+        progress_data[key] = value
+        progress_append({'op': 'set', 'key': key, 'value': value})
+    with _progress_cond:
+        _progress_cond.notify_all()
+
+def init_progress_logs(job_id, logs=None):
+    """Start a fresh log buffer for a job"""
+    with _progress_log_lock, _state_lock:
+        progress_logs[job_id] = deque(logs or [], maxlen=PROGRESS_LOG_MAXLEN)
+        _progress_log_seq[job_id] = len(progress_logs[job_id])
+        progress_append({'op': 'init', 'job': job_id, 'logs': list(logs or [])})
+    with _progress_cond:
+        _progress_cond.notify_all()
+
+# Progress storage: compact snapshot + append-only log of changes since the snapshot
 PROGRESS_FILE = WORKSPACE_DIR.parent / "progress_data.json"
+PROGRESS_LOG_FILE = WORKSPACE_DIR.parent / "progress_data.log"
+PROGRESS_COMPACT_INTERVAL = 60  # seconds between snapshot rewrites
+PROGRESS_LOG_MAXLEN = 500  # Only the most recent log lines are kept per job
+PROGRESS_STREAM_KEEPALIVE = 15  # seconds between keepalive comments on idle streams
+PROGRESS_STREAM_IDLE_LIMIT = 8  # keepalives without a change before a stream is closed
+
+# Guards progress state, active_jobs and current_job_id
+_state_lock = threading.RLock()
+
+# Notified on every progress change so /progress-stream can push updates
+_progress_cond = threading.Condition()
+_progress_log_seq = {}  # job_id -> number of log entries the job has had, including ones the deque dropped
+
+# Set whenever progress changes, cleared by the writer thread once compacted
+_progress_dirty = threading.Event()
+_progress_log_lock = threading.Lock()
+_progress_log_handle = None
+
+def _apply_progress_event(event):
+    """Apply one logged progress change to the in-memory state"""
+    op = event.get('op')
+    if op == 'set':
+        progress_data[event['key']] = event['value']
+    elif op == 'log':
+        if event['job'] not in progress_logs:
+            progress_logs[event['job']] = deque(maxlen=PROGRESS_LOG_MAXLEN)
+        progress_logs[event['job']].append(event['entry'])
+    elif op == 'init':
+        progress_logs[event['job']] = deque(event['logs'], maxlen=PROGRESS_LOG_MAXLEN)
+
+def progress_append(event):
+    """Append one progress change to the log file
+    
+    Callers hold _progress_log_lock and then _state_lock (the order save_progress uses) across
+    both the in-memory change and this write, so a snapshot never contains a change that is
+    then written to the fresh log as well and replayed twice.
+    """
+    global _progress_log_handle
+    line = orjson.dumps(event) + b'\n'
+    try:
+        if _progress_log_handle is None:
+            _progress_log_handle = open(PROGRESS_LOG_FILE, 'ab')
+        _progress_log_handle.write(line)
+        _progress_log_handle.flush()
+    except Exception as e:
+        print(f"Failed to log progress: {e}")
+    _progress_dirty.set()
 
 # Helper function to load progress from disk
 def load_progress():
-    """Load progress data from disk"""
+    """Load the progress snapshot and replay the change log on top of it"""
+    global progress_data, progress_logs
+    saved = {}
     if PROGRESS_FILE.exists():
         try:
-            with open(PROGRESS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(PROGRESS_FILE, 'rb') as f:
+                saved = orjson.loads(f.read())
         except:
-            return {}
-    return {}
+            saved = {}
+    progress_data = saved.get('progress_data', {})
+    progress_logs = {job_id: deque(logs, maxlen=PROGRESS_LOG_MAXLEN)
+                     for job_id, logs in saved.get('progress_logs', {}).items()}
+    
+    if PROGRESS_LOG_FILE.exists():
+        with open(PROGRESS_LOG_FILE, 'rb') as f:
+            for line in f:
+                try:
+                    _apply_progress_event(orjson.loads(line))
+                except:
+                    # Skip a torn last line from an interrupted write
+                    continue
 
 # Helper function to save progress to disk
 def save_progress():
-    """Save progress data to disk"""
+    """Write a compact progress snapshot and truncate the change log"""
+    global _progress_log_handle
     try:
-        data = {
-            'progress_data': progress_data,
-            'progress_logs': progress_logs
-        }
-        with open(PROGRESS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with _progress_log_lock:
+            with _state_lock:
+                data = {
+                    'progress_data': dict(progress_data),
+                    'progress_logs': {job_id: list(logs) for job_id, logs in progress_logs.items()}
+                }
+            # Write to a temp file and rename so a crash never leaves a torn snapshot
+            tmp_file = PROGRESS_FILE.with_suffix('.json.tmp')
+            with open(tmp_file, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+            os.replace(tmp_file, PROGRESS_FILE)
+            if _progress_log_handle is not None:
+                _progress_log_handle.close()
+            _progress_log_handle = open(PROGRESS_LOG_FILE, 'wb')
     except Exception as e:
         print(f"Failed to save progress: {e}")
 
+def progress_writer():
+    """Background thread: periodically compact the progress log into a snapshot"""
+    while True:
+        _progress_dirty.wait()
+        time.sleep(PROGRESS_COMPACT_INTERVAL)
+        _progress_dirty.clear()
+        save_progress()
+
+# Under spawn, pool workers and the Manager re-import this module as __mp_main__;
+# only the server process may own the progress files and background threads
+IS_MAIN_PROCESS = multiprocessing.parent_process() is None
+
 # Load existing progress on startup
-saved_progress = load_progress()
-progress_data = saved_progress.get('progress_data', {})
-progress_logs = saved_progress.get('progress_logs', {})
-
-# Clean up completed jobs from loaded progress
-for job_id in list(progress_data.keys()):
-    if 'COMPLETE' in str(progress_data.get(job_id, '')) or 'ERROR' in str(progress_data.get(job_id, '')):
-        # Keep completed jobs for display but don't restart them
-        pass
-
-# Helper function to create Telegram client with proper session handling
-def create_telegram_client(api_id, api_hash):
-    """Create TelegramClient with persistent session"""
-    from telethon import TelegramClient
-    
-    session_file = WORKSPACE_DIR.parent / "dailyarchive_session"
-    client = TelegramClient(
-        str(session_file),
-        int(api_id),
-        api_hash,
-        sequential_updates=True
-    )
-    return client
-
-async def start_telegram_client(client):
-    """Start Telegram client, reusing existing session if available"""
-    await client.connect()
-    if not await client.is_user_authorized():
-        await client.start()
-    return client
+progress_data = {}
+progress_logs = {}  # Store all log messages per job
+if IS_MAIN_PROCESS:
+    load_progress()
+    _progress_log_seq.update((job_id, len(logs)) for job_id, logs in progress_logs.items())
+
+# Jobs don't survive a restart; mark the ones that were still running so nothing waits on them
+if IS_MAIN_PROCESS:
+    for job_id, value in list(progress_data.items()):
+        if isinstance(value, str) and 'COMPLETE' not in value and 'ERROR' not in value:
+            set_progress(job_id, "ERROR: Interrupted by a restart")
+
+_upload_job_slots = None  # asyncio.Semaphore, created on the Telegram loop
+
+async def run_upload_job(coro):
+    """Run an upload job once a max_concurrent_uploads slot is free; the rest queue"""
+    global _upload_job_slots
+    if _upload_job_slots is None:
+        _upload_job_slots = asyncio.Semaphore(max(1, int(config.get('max_concurrent_uploads', 4))))
+    async with _upload_job_slots:
+        await coro
+
+_download_slots = None  # asyncio.Semaphore, created on the Telegram loop
+download_jobs = {}  # job_id -> Future of a queued or running download, for /cancel
+
+async def run_download_job(job_id, coro):
+    """Run a download job once a max_concurrent_downloads slot is free, marking it if cancelled"""
+    global _download_slots
+    if _download_slots is None:
+        _download_slots = asyncio.Semaphore(max(1, int(config.get('max_concurrent_downloads', 2))))
+    try:
+        async with _download_slots:
+            await coro
+    except asyncio.CancelledError:
+        coro.close()  # In case it was cancelled while still queued
+        set_progress(job_id, "ERROR: Cancelled")
+        add_progress_log(job_id, '[CANCELLED] Download cancelled', 'warning')
+        raise
+
+def submit_download(job_id, coro):
+    """Queue a download job on the Telegram loop and remember it until it finishes"""
+    future = submit_telegram(run_download_job(job_id, coro))
+    download_jobs[job_id] = future
+    future.add_done_callback(lambda _: download_jobs.pop(job_id, None))
 
 
 load_config()
 
-# Progress storage by job ID
-progress_data = {}
-progress_logs = {}  # Store all log messages per job
 active_jobs = set()  # Track active jobs to prevent duplicates
 current_job_id = None  # Track the currently active job
 
+def release_job(file_signature, job_id):
+    """Remove a finished job from active_jobs and clear it as the current job"""
+    global current_job_id
+    with _state_lock:
+        active_jobs.discard(file_signature)
+        if current_job_id == job_id:
+            current_job_id = None
+
+# CPU-heavy jobs run in worker processes and report back through a shared queue
+# Workers are spawned, never forked: the pool starts from a request thread while the Telegram
+# loop, progress writer and bridge threads run, and a fork could inherit one of their locks held
+_mp_context = multiprocessing.get_context('spawn')
+_executor = None  # ProcessPoolExecutor, created on first use
+_job_events = None  # Manager queue, created on first use
+_job_finishers = {}  # job_id -> callable run once the job's events are drained
+_job_events_lock = threading.Lock()
+
+def job_events_bridge(events):
+    """Background thread: apply worker progress events to the progress state"""
+    while True:
+        try:
+            kind, job_id, *args = events.get()
+        except (EOFError, OSError):
+            return  # Manager process went away (shutting down)
+        if kind == 'progress':
+            set_progress(job_id, args[0])
+        elif kind == 'log':
+            add_progress_log(job_id, *args)
+        elif kind == 'done':
+            finisher = _job_finishers.pop(job_id, None)
+            if finisher:
+                finisher()
+
+def get_job_events():
+    """Get the worker events queue, starting the manager and bridge thread if needed"""
+    global _job_events
+    with _job_events_lock:
+        if _job_events is None:
+            _job_events = _mp_context.Manager().Queue()
+            threading.Thread(target=job_events_bridge, args=(_job_events,), daemon=True).start()
+    return _job_events
+
+def get_executor():
+    """Get the process pool, creating it on first use"""
+    global _executor
+    with _job_events_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=_mp_context)
+    return _executor
+
+def submit_job(job_id, on_done, fn, *args):
+    """Run fn(*args, job_id, events) in the process pool, then on_done(future)"""
+    events = get_job_events()
+    future = get_executor().submit(fn, *args, job_id, events)
+    
+    def job_done(f):
+        # Queue completion behind the job's own events so it is applied last
+        _job_finishers[job_id] = lambda: on_done(f)
+        events.put(('done', job_id))
+    
+    future.add_done_callback(job_done)
+    return future
+
+# Persist progress in the background instead of on every poll
+if IS_MAIN_PROCESS:
+    threading.Thread(target=progress_writer, daemon=True).start()
+    atexit.register(save_progress)
+
 @app.route('/progress/<job_id>')
 def progress(job_id):
-    """Get progress for a job"""
-    msg = progress_data.get(job_id, '')
-    complete = 'COMPLETE' in msg or 'ERROR' in msg
-    results = progress_data.get(f"{job_id}_results", []) if complete else []
-    result = progress_data.get(f"{job_id}_result", {}) if complete else {}
-    logs = progress_logs.get(job_id, [])
-    
-    # Save progress to disk on every request
-    save_progress()
-    
-    return jsonify({'message': msg, 'complete': complete, 'results': results, 'result': result, 'logs': logs})
+    """Get progress for a job; ?since=<seq> returns only the log entries added after that point"""
+    since = request.args.get('since', type=int)
+    with _state_lock:
+        msg = progress_data.get(job_id, '')
+        complete = 'COMPLETE' in msg or 'ERROR' in msg
+        results = progress_data.get(f"{job_id}_results", []) if complete else []
+        result = progress_data.get(f"{job_id}_result", {}) if complete else {}
+        logs = list(progress_logs.get(job_id, []))
+        seq = _progress_log_seq.get(job_id, 0)
+    
+    # A since ahead of seq means the job's logs were reset, so send them all again
+    if since is not None and since <= seq:
+        logs = logs[len(logs) - min(seq - since, len(logs)):]
+    
+    return ojson({'message': msg, 'complete': complete, 'results': results, 'result': result, 'logs': logs, 'seq': seq})
+
+@app.route('/progress-stream/<job_id>')
+def progress_stream(job_id):
+    """Push progress for a job as server-sent events whenever it changes"""
+    def generate():
+        last_msg = None
+        last_seq = None
+        idle = 0
+        while True:
+            with _progress_cond:
+                if last_seq is not None and progress_data.get(job_id, '') == last_msg and _progress_log_seq.get(job_id, 0) == last_seq:
+                    _progress_cond.wait(timeout=PROGRESS_STREAM_KEEPALIVE)
+                msg = progress_data.get(job_id, '')
+                seq = _progress_log_seq.get(job_id, 0)
+                logs = list(progress_logs.get(job_id, []))
+            
+            if msg == last_msg and seq == last_seq:
+                # Each open stream holds a server thread: give up on unknown or stalled jobs
+                # and let the client fall back to polling
+                idle += 1
+                if idle >= PROGRESS_STREAM_IDLE_LIMIT or (not msg and job_id not in progress_logs):
+                    return
+                yield ': keepalive\n\n'
+                continue
+            idle = 0
+            
+            # First event carries the full history, later ones only new log entries
+            if last_seq is None or seq < last_seq:
+                new_logs = logs
+            else:
+                new_logs = logs[len(logs) - min(seq - last_seq, len(logs)):]
+            last_msg, last_seq = msg, seq
+            
+            complete = 'COMPLETE' in msg or 'ERROR' in msg
+            update = {
+                'message': msg,
+                'complete': complete,
+                'results': progress_data.get(f"{job_id}_results", []) if complete else [],
+                'result': progress_data.get(f"{job_id}_result", {}) if complete else {},
+                'logs': new_logs
+            }
+            yield b"data: " + orjson.dumps(update) + b"\n\n"
+            if complete:
+                return
+    
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 @app.route('/active-job')
 def get_active_job():
     """Get the currently active job ID"""
-    return jsonify({'job_id': current_job_id})
+    return ojson({'job_id': current_job_id})
 
 @app.route('/')
 def index():
     """Home page"""
     return render_template('index.html', config=config)
 
+def scan_files(root):
+    """Walk a directory tree with os.scandir, yielding (DirEntry, stat) for each file"""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and not entry.name.startswith('.'):
+                    yield entry, entry.stat()
+
+def find_archive_parts(folder):
+    """Find a folder's archives in one os.scandir walk
+    
+    Prefers split parts in the folder itself, then whole archives there, then
+    archives in subfolders (separately processed files), then split parts in subfolders.
+    """
+    root_parts, root_archives, nested_archives, nested_parts = [], [], [], []
+    stack = [(str(folder), True)]
+    while stack:
+        path, is_root = stack.pop()
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, False))
+                elif '.7z.' in entry.name:
+                    (root_parts if is_root else nested_parts).append(Path(entry.path))
+                elif entry.name.endswith('.7z'):
+                    (root_archives if is_root else nested_archives).append(Path(entry.path))
+    
+    # Root-level archives count for the subfolder searches too, like a ** glob
+    for candidates in (root_parts, root_archives, root_archives + nested_archives, root_parts + nested_parts):
+        if candidates:
+            return sorted(candidates)
+    return []
+
+# Cached /files response, reused while the workspace mtime is unchanged
+FILES_CACHE_TTL = 2  # seconds
+_files_cache = {'mtime': 0, 'payload': None, 'ts': 0}
+
 @app.route('/files')
 def list_files():
     """List files in archive folder"""
+    mtime = os.stat(WORKSPACE_DIR).st_mtime_ns
+    now = time.time()
+    if (_files_cache['payload'] is not None and _files_cache['mtime'] == mtime
+            and now - _files_cache['ts'] < FILES_CACHE_TTL):
+        return Response(_files_cache['payload'], mimetype='application/json')
+    
     files = []
-    for item in WORKSPACE_DIR.rglob('*'):
-        if item.is_file() and not item.name.startswith('.'):
-            rel_path = item.relative_to(WORKSPACE_DIR)
-            files.append({
-                'name': str(rel_path),
-                'size': item.stat().st_size,
-                'size_gb': round(item.stat().st_size / (1024**3), 2),
-                'modified': datetime.fromtimestamp(item.stat().st_mtime).strftime('%Y-%m-%d %H:%M')
-            })
-    return jsonify(files)
+    fromtimestamp = datetime.fromtimestamp
+    for entry, st in scan_files(WORKSPACE_DIR):
+        files.append({
+            'name': os.path.relpath(entry.path, WORKSPACE_DIR),
+            'size': st.st_size,
+            'size_gb': round(st.st_size / (1024**3), 2),
+            'modified': fromtimestamp(st.st_mtime).strftime('%Y-%m-%d %H:%M')
+        })
+    
+    payload = orjson.dumps(files)
+    _files_cache.update(mtime=mtime, payload=payload, ts=now)
+    return Response(payload, mimetype='application/json')
+
+_name_index_cache = {'mtime': 0, 'index': None, 'ts': 0}
+
+def workspace_name_index():
+    """Map file names anywhere in the workspace to (path, size), top-level files first"""
+    mtime = os.stat(WORKSPACE_DIR).st_mtime_ns
+    now = time.time()
+    if (_name_index_cache['index'] is not None and _name_index_cache['mtime'] == mtime
+            and now - _name_index_cache['ts'] < FILES_CACHE_TTL):
+        return _name_index_cache['index']
+    
+    index = {}
+    for entry, st in scan_files(WORKSPACE_DIR):
+        index.setdefault(entry.name, (Path(entry.path), st.st_size))
+    _name_index_cache.update(mtime=mtime, index=index, ts=now)
+    return index
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
@@ -179,6 +504,27 @@ def upload_files():
     
     return jsonify({'success': True, 'files': uploaded})
 
+@app.route('/upload-stream', methods=['POST'])
+def upload_stream():
+    """Upload a single file sent as the raw request body"""
+    filename = secure_filename(request.headers.get('X-Filename', ''))
+    if not filename:
+        return jsonify({'error': 'X-Filename header required'}), 400
+    
+    # Write to a temp file in 1 MiB chunks so partial uploads never show up in /files
+    filepath = WORKSPACE_DIR / filename
+    temp_path = WORKSPACE_DIR / f".{filename}.part"
+    try:
+        with open(temp_path, 'wb') as f:
+            while chunk := request.stream.read(1 << 20):
+                f.write(chunk)
+        os.replace(temp_path, filepath)
+    except Exception as e:
+        temp_path.unlink(missing_ok=True)
+        return jsonify({'error': str(e)}), 500
+    
+    return jsonify({'success': True, 'files': [filename]})
+
 @app.route('/compress', methods=['POST'])
 def compress():
     """Compress video files"""
@@ -193,76 +539,37 @@ def compress():
     file_signature = '|'.join(sorted(files))
     
     # Check if these files are already being processed
-    if file_signature in active_jobs:
-        # Return the existing job_id instead of error
-        if current_job_id:
-            return jsonify({'success': True, 'job_id': current_job_id, 'reused': True})
-        else:
-            return jsonify({'error': 'These files are already being processed'}), 409
-    
-    job_id = str(int(time.time() * 1000))
-    active_jobs.add(file_signature)
-    
-    current_job_id = job_id
+    with _state_lock:
+        if file_signature in active_jobs:
+            # Return the existing job_id instead of error
+            if current_job_id:
+                return jsonify({'success': True, 'job_id': current_job_id, 'reused': True})
+            else:
+                return jsonify({'error': 'These files are already being processed'}), 409
+        
+        job_id = str(int(time.time() * 1000))
+        active_jobs.add(file_signature)
+        
+        current_job_id = job_id
     
     # Initialize progress
-    progress_data[job_id] = "Starting compression..."
-    progress_logs[job_id] = initial_logs  # Store initial logs from frontend
+    set_progress(job_id, "Starting compression...")
+    init_progress_logs(job_id, initial_logs)  # Store initial logs from frontend
     
-    # Run compression in background thread
-    def compress_task():
-        results = []  # Initialize results list
+    def finish_compress(future):
         try:
-            for filename in files:
-                filepath = WORKSPACE_DIR / filename
-                if not filepath.exists():
-                    continue
-                
-                # Create output folder
-                date_str = datetime.now().strftime('%Y%m%d')
-                counter = 1
-                while True:
-                    folder_name = f"{date_str}_{filepath.stem}" if counter == 1 else f"{date_str}_{counter}_{filepath.stem}"
-                    output_dir = WORKSPACE_DIR / folder_name
-                    if not output_dir.exists():
-                        break
-                    counter += 1
-                
-                output_dir.mkdir(parents=True, exist_ok=True)
-                
-                add_progress_log(job_id, f'[{files.index(filename) + 1}/{len(files)}] Compressing {filepath.name}...', 'info')
-                
-                def progress_callback(msg):
-                    progress_data[job_id] = msg
-                
-                compressed = compress_video(filepath, output_dir, keep_audio, progress_callback, 
-                                          cpu_preset=config.get('cpu_preset', 'normal'),
-                                          cpu_threads=config.get('cpu_threads', 0))
-                
-                if compressed:
-                    add_progress_log(job_id, f'[OK] Compressed {filepath.name} → {compressed.name} ({round(get_file_size_gb(compressed), 2)} GB)', 'success')
-                    results.append({
-                        'original': filename,
-                        'compressed': str(compressed.relative_to(WORKSPACE_DIR)),
-                        'size': round(get_file_size_gb(compressed), 2)
-                    })
-            
-            progress_data[job_id] = "COMPLETE"
-            progress_data[f"{job_id}_results"] = results
+            results = future.result()
+            set_progress(job_id, "COMPLETE")
+            set_progress(f"{job_id}_results", results)
         except Exception as e:
-            progress_data[job_id] = f"ERROR: {str(e)}"
-            progress_logs[job_id].append({'time': datetime.now().isoformat(), 'msg': f"ERROR: {str(e)}", 'type': 'error'})
+            set_progress(job_id, f"ERROR: {str(e)}")
+            add_progress_log(job_id, f"ERROR: {str(e)}", 'error')
         finally:
-            # Remove from active jobs when done
-            if file_signature in active_jobs:
-                active_jobs.remove(file_signature)
-            # Clear current job if this was it
-            global current_job_id
-            if current_job_id == job_id:
-                current_job_id = None
-    
-    thread = threading.Thread(target=compress_task)
-    thread.start()
+            release_job(file_signature, job_id)
+    
+    # Run compression in a worker process
+    submit_job(job_id, finish_compress, run_compress, files, keep_audio,
+               config.get('cpu_preset', 'normal'), config.get('cpu_threads', 0), config.get('video_encoder', 'cpu'))
     
     return jsonify({'success': True, 'job_id': job_id})
 
@@ -278,24 +585,32 @@ def encrypt():
     
     # Create a unique job identifier to prevent duplicates
     file_signature = f"encrypt|{bundle}|{encrypt_files}|{'|'.join(sorted(files))}"
-    if file_signature in active_jobs:
-        return jsonify({'error': 'These files are already being processed'}), 409
-    
-    job_id = str(int(time.time() * 1000))
-    active_jobs.add(file_signature)
-    
-    global current_job_id
-    current_job_id = job_id
-    
-
     
     if encrypt_files and not config.get('password'):
         return jsonify({'error': 'No password set'}), 400
     
-    file_paths = [WORKSPACE_DIR / f for f in files if (WORKSPACE_DIR / f).exists()]
+    # Stat each file once; the sizes are reused for split decisions below
+    file_paths = []
+    file_sizes = []
+    for f in files:
+        try:
+            st = (WORKSPACE_DIR / f).stat()
+        except OSError:
+            continue
+        file_paths.append(WORKSPACE_DIR / f)
+        file_sizes.append(st.st_size)
     if not file_paths:
         return jsonify({'error': 'No valid files'}), 400
     
+    global current_job_id
+    with _state_lock:
+        if file_signature in active_jobs:
+            return jsonify({'error': 'These files are already being processed'}), 409
+        
+        job_id = str(int(time.time() * 1000))
+        active_jobs.add(file_signature)
+        current_job_id = job_id
+    
     # Create output folder
     date_str = datetime.now().strftime('%Y%m%d')
     counter = 1
@@ -306,22 +621,27 @@ def encrypt():
             break
         counter += 1
     
-    output_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    except Exception as e:
+        # Don't leave the files marked as busy if the job never starts
+        release_job(file_signature, job_id)
+        return jsonify({'error': str(e)}), 500
     
     # Initialize progress
-    progress_data[job_id] = "Starting..."
-    progress_logs[job_id] = []
+    set_progress(job_id, "Starting...")
+    init_progress_logs(job_id)
     
     password = config.get('password') if encrypt_files else None
     
     def process_task():
         try:
             def progress_callback(msg):
-                progress_data[job_id] = msg
+                set_progress(job_id, msg)
             
             if bundle:
                 # Bundle all files into one archive
-                total_size_bytes = sum(f.stat().st_size for f in file_paths)
+                total_size_bytes = sum(file_sizes)
                 total_size_mb = total_size_bytes / (1024 * 1024)
                 split_size_mb = config.get('split_size_mb', 2000)
                 should_split = total_size_mb > split_size_mb
@@ -336,59 +656,58 @@ def encrypt():
                 if encrypt_files:
                     # Encrypted bundle - always check for split
                     if should_split:
-                        parts = split_and_encrypt_multiple(file_paths, output_dir, password, archive_name, progress_callback)
+                        parts = split_and_encrypt_multiple(file_paths, output_dir, password, archive_name, progress_callback, sizes=file_sizes)
                         if parts:
                             add_progress_log(job_id, f'[OK] Encrypted and split into {len(parts)} part(s): {archive_name}', 'success')
-                            progress_data[job_id] = "COMPLETE"
-                            progress_data[f"{job_id}_result"] = {
+                            set_progress(job_id, "COMPLETE")
+                            set_progress(f"{job_id}_result", {
                                 'success': True,
                                 'folder': archive_name,
                                 'parts': len(parts),
                                 'split': True,
                                 'encrypted': True
-                            }
+                            })
                         else:
                             raise Exception("Encryption failed")
                     else:
                         encrypted = encrypt_multiple_files(file_paths, output_dir, password, archive_name, progress_callback)
                         if encrypted:
-                            progress_data[job_id] = "COMPLETE"
-                            progress_data[f"{job_id}_result"] = {
+                            set_progress(job_id, "COMPLETE")
+                            set_progress(f"{job_id}_result", {
                                 'success': True,
                                 'folder': archive_name,
                                 'file': encrypted.name,
                                 'split': False,
                                 'encrypted': True
-                            }
+                            })
                         else:
                             raise Exception("Encryption failed")
                 else:
                     # Non-encrypted bundle - also check for split
-                    from encryption import archive_multiple_files_no_password, split_archive_no_password
                     if should_split:
-                        parts = split_archive_no_password(file_paths, output_dir, archive_name, split_size_mb, progress_callback)
+                        parts = split_archive_no_password(file_paths, output_dir, archive_name, split_size_mb, progress_callback, sizes=file_sizes)
                         if parts:
-                            progress_data[job_id] = "COMPLETE"
-                            progress_data[f"{job_id}_result"] = {
+                            set_progress(job_id, "COMPLETE")
+                            set_progress(f"{job_id}_result", {
                                 'success': True,
                                 'folder': archive_name,
                                 'parts': len(parts),
                                 'split': True,
                                 'encrypted': False
-                            }
+                            })
                         else:
                             raise Exception("Archiving failed")
                     else:
                         archived = archive_multiple_files_no_password(file_paths, output_dir, archive_name, progress_callback)
                         if archived:
-                            progress_data[job_id] = "COMPLETE"
-                            progress_data[f"{job_id}_result"] = {
+                            set_progress(job_id, "COMPLETE")
+                            set_progress(f"{job_id}_result", {
                                 'success': True,
                                 'folder': archive_name,
                                 'file': archived.name,
                                 'split': False,
                                 'encrypted': False
-                            }
+                            })
                         else:
                             raise Exception("Archiving failed")
             else:
@@ -400,92 +719,115 @@ def encrypt():
                 uploaded_count = 0
                 total_files = len(file_paths)
                 
-                # Collect all files to upload in batch with source mapping
-                files_to_upload = []
-                file_source_map = {}  # Map output file to original source file
+                # Archived files go straight to an upload thread, so file N uploads
+                # while file N+1 is still being archived
+                upload_q = queue.Queue(maxsize=4)
+                queued = [0]  # Number of files handed to the upload stage so far
+                upload_result = [0, None]  # Uploaded count, error
                 
-                for i, file_path in enumerate(file_paths, 1):
-                    file_output_dir = output_dir / file_path.stem
-                    file_output_dir.mkdir(parents=True, exist_ok=True)
+                async def upload_batch():
+                    client = await get_shared_client()
+                    return await upload_multiple_files_batch(client, upload_q, upload_destination, job_id, queued)
+                
+                def upload_worker():
+                    try:
+                        upload_result[0] = run_async(upload_batch())
+                    except Exception as e:
+                        upload_result[1] = e
+                        # Keep draining so the archive stage never blocks on a full queue
+                        while upload_q.get() is not None:
+                            pass
+                
+                def queue_upload(path, source, total_parts=1):
+                    queued[0] += 1
+                    upload_q.put((path, source, total_parts))
+                
+                def archive_files_separately():
+                    for i, file_path in enumerate(file_paths, 1):
+                        file_output_dir = output_dir / file_path.stem
+                        file_output_dir.mkdir(parents=True, exist_ok=True)
                     
-                    # Store original file path relative to workspace
-                    original_relative_path = str(file_path.relative_to(WORKSPACE_DIR))
+                        # Store original file path relative to workspace
+                        original_relative_path = str(file_path.relative_to(WORKSPACE_DIR))
                     
-                    # Check if file needs splitting
-                    file_size_mb = file_path.stat().st_size / (1024 * 1024)
-                    needs_split = file_size_mb > split_size_mb
+                        # Check if file needs splitting
+                        file_size_mb = file_sizes[i - 1] / (1024 * 1024)
+                        needs_split = file_size_mb > split_size_mb
                     
-                    # Create progress callback that shows overall progress
-                    def file_progress_callback(msg):
-                        # Extract percentage from message like "Encrypting: 45% complete"
-                        import re
-                        match = re.search(r'(\d+)%', msg)
-                        if match:
-                            file_percent = int(match.group(1))
-                            # Calculate overall progress: (completed files + current file progress) / total files
-                            overall_percent = ((i - 1) * 100 + file_percent) / total_files
-                            action = "Encrypting" if encrypt_files else "Archiving"
-                            progress_callback(f"{action}: {overall_percent:.0f}% complete")
-                        else:
-                            progress_callback(msg)
+                        # Create progress callback that shows overall progress
+                        def file_progress_callback(msg):
+                            # Extract percentage from message like "Encrypting: 45% complete"
+                            match = _PCT_RE.search(msg)
+                            if match:
+                                file_percent = int(match.group(1))
+                                # Calculate overall progress: (completed files + current file progress) / total files
+                                overall_percent = ((i - 1) * 100 + file_percent) / total_files
+                                action = "Encrypting" if encrypt_files else "Archiving"
+                                progress_callback(f"{action}: {overall_percent:.0f}% complete")
+                            else:
+                                progress_callback(msg)
                     
-                    if encrypt_files:
-                        # Encrypt each file separately (with split if needed)
-                        from encryption import encrypt_file, encrypt_and_split_file
+                        if encrypt_files:
+                            # Encrypt each file separately (with split if needed)
                         
-                        if needs_split:
-                            add_progress_log(job_id, f'[{i}/{len(file_paths)}] Encrypting and splitting {file_path.name} ({file_size_mb:.0f}MB)...', 'info')
-                            parts = encrypt_and_split_file(file_path, file_output_dir, password, split_size_mb, file_progress_callback)
-                            if parts:
-                                for part in parts:
-                                    results.append(str(part.relative_to(output_dir)))
+                            if needs_split:
+                                add_progress_log(job_id, f'[{i}/{len(file_paths)}] Encrypting and splitting {file_path.name} ({file_size_mb:.0f}MB)...', 'info')
+                                parts = encrypt_and_split_file(file_path, file_output_dir, password, split_size_mb, file_progress_callback, size=file_sizes[i - 1])
+                                if parts:
+                                    for part in parts:
+                                        results.append(str(part.relative_to(output_dir)))
+                                        if auto_upload:
+                                            queue_upload(part, original_relative_path, len(parts))
+                                    add_progress_log(job_id, f'[{i}/{len(file_paths)}] Encrypted {file_path.name} into {len(parts)} part(s)', 'success')
+                            else:
+                                encrypted = encrypt_file(file_path, file_output_dir, password, file_progress_callback)
+                                if encrypted:
+                                    results.append(str(encrypted.relative_to(output_dir)))
+                                    add_progress_log(job_id, f'[{i}/{len(file_paths)}] Encrypted {file_path.name}', 'success')
                                     if auto_upload:
-                                        files_to_upload.append(part)
-                                        file_source_map[str(part)] = original_relative_path
-                                add_progress_log(job_id, f'[{i}/{len(file_paths)}] Encrypted {file_path.name} into {len(parts)} part(s)', 'success')
+                                        queue_upload(encrypted, original_relative_path)
                         else:
-                            encrypted = encrypt_file(file_path, file_output_dir, password, file_progress_callback)
-                            if encrypted:
-                                results.append(str(encrypted.relative_to(output_dir)))
-                                add_progress_log(job_id, f'[{i}/{len(file_paths)}] Encrypted {file_path.name}', 'success')
-                                if auto_upload:
-                                    files_to_upload.append(encrypted)
-                                    file_source_map[str(encrypted)] = original_relative_path
-                    else:
-                        # Archive each file separately (no password, with split if needed)
-                        from encryption import archive_file_no_password, archive_and_split_file_no_password
+                            # Archive each file separately (no password, with split if needed)
                         
-                        if needs_split:
-                            add_progress_log(job_id, f'[{i}/{len(file_paths)}] Archiving and splitting {file_path.name} ({file_size_mb:.0f}MB)...', 'info')
-                            parts = archive_and_split_file_no_password(file_path, file_output_dir, split_size_mb, file_progress_callback)
-                            if parts:
-                                for part in parts:
-                                    results.append(str(part.relative_to(output_dir)))
+                            if needs_split:
+                                add_progress_log(job_id, f'[{i}/{len(file_paths)}] Archiving and splitting {file_path.name} ({file_size_mb:.0f}MB)...', 'info')
+                                parts = archive_and_split_file_no_password(file_path, file_output_dir, split_size_mb, file_progress_callback, size=file_sizes[i - 1])
+                                if parts:
+                                    for part in parts:
+                                        results.append(str(part.relative_to(output_dir)))
+                                        if auto_upload:
+                                            queue_upload(part, original_relative_path, len(parts))
+                                    add_progress_log(job_id, f'[{i}/{len(file_paths)}] Archived {file_path.name} into {len(parts)} part(s)', 'success')
+                            else:
+                                archived = archive_file_no_password(file_path, file_output_dir, file_progress_callback)
+                                if archived:
+                                    results.append(str(archived.relative_to(output_dir)))
+                                    add_progress_log(job_id, f'[{i}/{len(file_paths)}] Archived {file_path.name}', 'success')
                                     if auto_upload:
-                                        files_to_upload.append(part)
-                                        file_source_map[str(part)] = original_relative_path
-                                add_progress_log(job_id, f'[{i}/{len(file_paths)}] Archived {file_path.name} into {len(parts)} part(s)', 'success')
-                        else:
-                            archived = archive_file_no_password(file_path, file_output_dir, file_progress_callback)
-                            if archived:
-                                results.append(str(archived.relative_to(output_dir)))
-                                add_progress_log(job_id, f'[{i}/{len(file_paths)}] Archived {file_path.name}', 'success')
-                                if auto_upload:
-                                    files_to_upload.append(archived)
-                                    file_source_map[str(archived)] = original_relative_path
+                                        queue_upload(archived, original_relative_path)
+
+                upload_thread = None
+                if auto_upload:
+                    add_progress_log(job_id, '[UPLOAD] Uploading files as they are archived...', 'info')
+                    upload_thread = threading.Thread(target=upload_worker, daemon=True)
+                    upload_thread.start()
                 
-                # Upload all files in batch with single client connection
-                if auto_upload and files_to_upload:
-                    add_progress_log(job_id, f'[UPLOAD] Starting batch upload of {len(files_to_upload)} file(s)...', 'info')
-                    try:
-                        asyncio.run(upload_multiple_files_batch(files_to_upload, upload_destination, job_id, file_source_map))
-                        uploaded_count = len(files_to_upload)
+                try:
+                    archive_files_separately()
+                finally:
+                    if upload_thread:
+                        upload_q.put(None)
+                        upload_thread.join()
+                
+                if upload_thread:
+                    uploaded_count = upload_result[0]
+                    if upload_result[1] is not None:
+                        add_progress_log(job_id, f'[ERROR] Batch upload failed: {str(upload_result[1])}', 'error')
+                    else:
                         add_progress_log(job_id, f'[OK] Uploaded {uploaded_count} file(s) successfully', 'success')
-                    except Exception as e:
-                        add_progress_log(job_id, f'[ERROR] Batch upload failed: {str(e)}', 'error')
                 
-                progress_data[job_id] = "COMPLETE"
-                progress_data[f"{job_id}_result"] = {
+                set_progress(job_id, "COMPLETE")
+                set_progress(f"{job_id}_result", {
                     'success': True,
                     'folder': archive_name,
                     'files': results,
@@ -493,42 +835,83 @@ def encrypt():
                     'encrypted': encrypt_files,
                     'separate': True,
                     'uploaded': uploaded_count if auto_upload else 0
-                }
+                })
                 
         except Exception as e:
-            progress_data[job_id] = f"ERROR: {str(e)}"
+            set_progress(job_id, f"ERROR: {str(e)}")
             add_progress_log(job_id, f'[ERROR] Processing failed: {str(e)}', 'error')
         finally:
-            # Remove from active jobs when done
-            if file_signature in active_jobs:
-                active_jobs.remove(file_signature)
-            # Clear current job if this was it
-            global current_job_id
-            if current_job_id == job_id:
-                current_job_id = None
+            release_job(file_signature, job_id)
     
     thread = threading.Thread(target=process_task)
     thread.start()
     
     return jsonify({'success': True, 'job_id': job_id})
 
-async def upload_multiple_files_batch(file_paths, destination, job_id, file_source_map=None):
-    """Upload multiple files to Telegram using a single client connection"""
-    from telethon.tl.functions.messages import SendMediaRequest
-    from telethon.tl.types import InputMediaUploadedDocument, DocumentAttributeFilename
-    from parallel_upload import parallel_upload_file
-    from datetime import datetime
-    from encryption import list_archive_contents
+def start_progress_ticker(job_id, sent, label, filename, interval=0.5):
+    """Publish transfer progress from sent = [bytes, total] every interval; returns a stop function"""
+    stop = threading.Event()
+    start_time = time.time()
+    
+    def tick():
+        last_time = start_time
+        last_bytes = 0
+        while not stop.wait(interval):
+            current, total = sent
+            if not total:
+                continue
+            now = time.time()
+            speed_mbps = ((current - last_bytes) / (now - last_time)) / (1024 * 1024)
+            last_time = now
+            last_bytes = current
+            percent = (current / total) * 100
+            set_progress(job_id, f"{label}: {percent:.1f}% ({speed_mbps:.2f} MB/s) - {filename}")
+        
+        # Final update with the average speed once the transfer finishes
+        current, total = sent
+        if total and current == total:
+            total_time = time.time() - start_time
+            avg_speed = (total / total_time) / (1024 * 1024) if total_time > 0 else 0
+            set_progress(job_id, f"{label}: 100.0% ({avg_speed:.2f} MB/s) - {filename}")
+    
+    threading.Thread(target=tick, daemon=True).start()
+    return stop.set
+
+def count_split_parts(folder, base_name):
+    """Count the base_name.7z.NNN parts in folder without building a list"""
+    return sum(1 for _ in folder.glob(f"{base_name}.7z.*"))
+
+def throttled_progress(job_id, label, filename, interval_ns=500_000_000):
+    """Build a Telethon progress callback that updates job status at most every interval_ns"""
+    start_ns = time.monotonic_ns()
+    state = [start_ns + interval_ns, start_ns, 0, 0.0]  # Next deadline, last time, last bytes, 100 / total
+    
+    def callback(current, total):
+        now_ns = time.monotonic_ns()
+        if now_ns < state[0] and current != total:
+            return
+        if not state[3]:
+            state[3] = 100.0 / total
+        if current == total:
+            # Final update with the average speed
+            elapsed_ns = now_ns - start_ns
+            speed_mbps = (total * 1_000_000_000 / elapsed_ns) / (1024 * 1024) if elapsed_ns else 0
+        else:
+            speed_mbps = ((current - state[2]) * 1_000_000_000 / (now_ns - state[1])) / (1024 * 1024)
+        state[0] = now_ns + interval_ns
+        state[1] = now_ns
+        state[2] = current
+        set_progress(job_id, f"{label}: {current * state[3]:.1f}% ({speed_mbps:.2f} MB/s) - {filename}")
     
-    if file_source_map is None:
-        file_source_map = {}
+    return callback
+
+UPLOAD_CONCURRENCY = 3  # Files uploaded at once within a batch job
+
+async def upload_multiple_files_batch(client, upload_q, destination, job_id, queued):
+    """Upload files from upload_q as they arrive over an already connected client"""
     
-    client = None
+    uploaded = 0
     try:
-        # Create single client connection for all uploads
-        client = create_telegram_client(config['telegram_api_id'], config['telegram_api_hash'])
-        await start_telegram_client(client)
-        
         # Convert destination - default to 'me' if empty or None
         dest = destination if destination and destination.strip() else config.get('upload_destination', 'me')
         if not dest or dest.strip() == '':
@@ -536,82 +919,69 @@ async def upload_multiple_files_batch(file_paths, destination, job_id, file_sour
         
         add_progress_log(job_id, f'[UPLOAD] Destination: {dest}', 'info')
         
-        if dest != "me" and dest.lstrip('-').isdigit():
-            dest = int(dest)
+        dest = await resolve_destination(client, dest)
         
-        total_files = len(file_paths)
+        # Split the connection budget between concurrent files so the socket count stays the same
+        max_connections = max(1, config.get('parallel_connections', 20) // UPLOAD_CONCURRENCY)
+        sem = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+        caption_mode = config.get("upload_caption", "detailed")
         
-        for i, file_path in enumerate(file_paths, 1):
+        async def upload_one(i, total_files, file_path, original_source, total_parts, prev_sent, sent_done):
             try:
                 add_progress_log(job_id, f'[{i}/{total_files}] Uploading {file_path.name}...', 'info')
                 
-                # Get original source file path
-                original_source = file_source_map.get(str(file_path), file_path.name)
-                
-                # Upload file with progress tracking
-                import time
-                start_time = time.time()
-                last_update = [start_time]
-                last_bytes = [0]
+                # The callback only records bytes sent; a ticker thread formats the status
+                sent = [0, 0]  # Bytes sent, total bytes
                 
                 def upload_progress(current, total):
-                    now = time.time()
-                    elapsed = now - last_update[0]
-                    
-                    if elapsed >= 0.5:
-                        bytes_diff = current - last_bytes[0]
-                        speed_mbps = (bytes_diff / elapsed) / (1024 * 1024)
-                        last_update[0] = now
-                        last_bytes[0] = current
-                        
-                        percent = (current / total) * 100
-                        progress_data[job_id] = f"Uploading [{i}/{total_files}]: {percent:.1f}% ({speed_mbps:.2f} MB/s) - {file_path.name}"
-                    elif current == total:
-                        total_time = now - start_time
-                        avg_speed = (total / total_time) / (1024 * 1024) if total_time > 0 else 0
-                        progress_data[job_id] = f"Uploading [{i}/{total_files}]: 100.0% ({avg_speed:.2f} MB/s) - {file_path.name}"
+                    sent[0] = current
+                    sent[1] = total
                 
-                uploaded_file, file_size = await parallel_upload_file(
-                    client, str(file_path), upload_progress, 
-                    max_connections=config.get('parallel_connections', 20)
-                )
+                stop_ticker = start_progress_ticker(job_id, sent, f"Uploading [{i}/{total_files}]", file_path.name)
+                
+                try:
+                    uploaded_file, file_size = await parallel_upload_file(
+                        client, str(file_path), upload_progress, 
+                        max_connections=max_connections
+                    )
+                finally:
+                    stop_ticker()
                 
                 # Generate caption
-                caption_mode = config.get("upload_caption", "detailed")
                 if caption_mode == "none":
                     caption = ""
                 elif caption_mode == "minimal":
                     caption = f"📦 {original_source}"
                 else:  # detailed
-                    file_size_mb = file_path.stat().st_size / (1024 * 1024)
-                    created_date = datetime.fromtimestamp(file_path.stat().st_ctime).strftime("%Y-%m-%d %H:%M")
+                    st = file_path.stat()
+                    file_size_mb = st.st_size / (1024 * 1024)
+                    created_date = time.strftime("%Y-%m-%d %H:%M", time.localtime(st.st_ctime))
                     upload_date = datetime.now().strftime("%Y-%m-%d %H:%M")
                     
                     # Detect if this is a split part and if it's encrypted
-                    import re
-                    part_match = re.search(r'\.7z\.(\d+)$', file_path.name)
-                    is_encrypted = file_path.suffix == '.7z' or '.7z.' in file_path.name or file_path.name.endswith('.7z')
+                    name = file_path.name
+                    part_match = _PART_RE.search(name)
+                    is_encrypted = name.endswith('.7z') or '.7z.' in name
                     
                     if part_match:
                         part_num = int(part_match.group(1))
-                        base_name = re.sub(r'\.7z\.\d+$', '', file_path.name)
-                        total_parts = len(list(file_path.parent.glob(f"{base_name}.7z.*")))
-                        caption = f"📦 Part {part_num} of {total_parts}\n"
-                        caption += f"Archive: {file_path.name}\n"
-                        caption += f"Source: {original_source}\n"
+                        cap = [f"📦 Part {part_num} of {total_parts}\n"]
+                        cap.append(f"Archive: {file_path.name}\n")
+                        cap.append(f"Source: {original_source}\n")
                     else:
-                        caption = f"📦 Archive: {file_path.name}\n"
-                        caption += f"Source: {original_source}\n"
+                        cap = [f"📦 Archive: {file_path.name}\n"]
+                        cap.append(f"Source: {original_source}\n")
                     
-                    caption += f"📊 Size: {file_size_mb:.2f} MB\n"
+                    cap.append(f"📊 Size: {file_size_mb:.2f} MB\n")
                     
                     if is_encrypted:
-                        caption += f"🔒 Encrypted: Yes\n"
+                        cap.append(f"🔒 Encrypted: Yes\n")
                     else:
-                        caption += f"⚠️ Encrypted: No (Unprotected)\n"
+                        cap.append(f"⚠️ Encrypted: No (Unprotected)\n")
                     
-                    caption += f"\n📅 Created: {created_date}\n"
-                    caption += f"⬆️ Uploaded: {upload_date}"
+                    cap.append(f"\n📅 Created: {created_date}\n")
+                    cap.append(f"⬆️ Uploaded: {upload_date}")
+                    caption = "".join(cap)
                 
                 # Send to Telegram
                 media = InputMediaUploadedDocument(
@@ -620,6 +990,8 @@ async def upload_multiple_files_batch(file_paths, destination, job_id, file_sour
                     attributes=[DocumentAttributeFilename(file_name=file_path.name)]
                 )
                 
+                # Send in queue order so split parts stay in sequence in the chat
+                await prev_sent.wait()
                 await client(SendMediaRequest(
                     peer=dest,
                     media=media,
@@ -627,161 +999,151 @@ async def upload_multiple_files_batch(file_paths, destination, job_id, file_sour
                 ))
                 
                 add_progress_log(job_id, f'[OK] Uploaded {file_path.name}', 'success')
-                
-            except Exception as file_error:
-                add_progress_log(job_id, f'[ERROR] Failed to upload {file_path.name}: {str(file_error)}', 'error')
-                # Continue with next file instead of stopping
-                continue
+            finally:
+                # Only signal once everything queued before this file has been sent too
+                await prev_sent.wait()
+                sent_done.set()
+                sem.release()
         
-        # Disconnect after all uploads complete
-        if client:
-            await client.disconnect()
+        tasks = []
+        prev_sent = asyncio.Event()
+        prev_sent.set()
+        i = 0
+        while True:
+            # Wait for a free slot before taking more work, so the archive stage stays throttled
+            await sem.acquire()
+            # Block in a worker thread so the event loop keeps running
+            item = await asyncio.to_thread(upload_q.get)
+            if item is None:
+                sem.release()
+                break
+            file_path, original_source, total_parts = item
+            i += 1
+            # Total grows while the archive stage is still producing files
+            total_files = queued[0]
+            
+            sent_done = asyncio.Event()
+            task = asyncio.create_task(upload_one(i, total_files, file_path, original_source, total_parts, prev_sent, sent_done))
+            tasks.append((file_path, task))
+            prev_sent = sent_done
+        
+        results = await asyncio.gather(*(task for _, task in tasks), return_exceptions=True)
+        for (file_path, _), result in zip(tasks, results):
+            if isinstance(result, Exception):
+                # One failed file doesn't stop the rest of the batch
+                add_progress_log(job_id, f'[ERROR] Failed to upload {file_path.name}: {str(result)}', 'error')
+            else:
+                uploaded += 1
+        
+        return uploaded
         
     except Exception as e:
         add_progress_log(job_id, f'[ERROR] Batch upload exception: {str(e)}', 'error')
-        import traceback
         add_progress_log(job_id, f'[ERROR] Traceback: {traceback.format_exc()}', 'error')
-        if client:
-            try:
-                await client.disconnect()
-            except:
-                pass
         raise
 
 async def upload_single_file(file_path, destination, job_id):
     """Upload a single file to Telegram immediately"""
-    from telethon.tl.functions.messages import SendMediaRequest
-    from telethon.tl.types import InputMediaUploadedDocument, DocumentAttributeFilename
-    from parallel_upload import parallel_upload_file
-    from datetime import datetime
-    from encryption import list_archive_contents
     
     try:
-        client = create_telegram_client(config['telegram_api_id'], config['telegram_api_hash'])
-        await start_telegram_client(client)
+        client = await get_shared_client()
         
-        # Convert destination
-        dest = destination
-        if dest != "me" and dest.lstrip('-').isdigit():
-            dest = int(dest)
+        dest = await resolve_destination(client, destination)
         
         # Upload file with progress tracking and speed calculation
-        import time
-        start_time = time.time()
-        last_update = [start_time]
-        last_bytes = [0]
+        upload_progress = throttled_progress(job_id, "Uploading", file_path.name)
         
-        def upload_progress(current, total):
-            now = time.time()
-            elapsed = now - last_update[0]
-            
-            if elapsed >= 0.5:  # Update every 0.5 seconds
-                bytes_diff = current - last_bytes[0]
-                speed_mbps = (bytes_diff / elapsed) / (1024 * 1024)
-                last_update[0] = now
-                last_bytes[0] = current
-                
-                percent = (current / total) * 100
-                progress_data[job_id] = f"Uploading: {percent:.1f}% ({speed_mbps:.2f} MB/s) - {file_path.name}"
-            elif current == total:  # Final update
-                total_time = now - start_time
-                avg_speed = (total / total_time) / (1024 * 1024) if total_time > 0 else 0
-                progress_data[job_id] = f"Uploading: 100.0% ({avg_speed:.2f} MB/s) - {file_path.name}"
-        
-        uploaded_file, file_size = await parallel_upload_file(
+        # Build the caption while the file uploads
+        upload = asyncio.create_task(parallel_upload_file(
             client, str(file_path), upload_progress,
             max_connections=config.get('parallel_connections', 20)
-        )
+        ))
         
-        # Generate caption
-        caption_mode = config.get("upload_caption", "detailed")
-        if caption_mode == "none":
-            caption = ""
-        elif caption_mode == "minimal":
-            caption = f"📦 {file_path.name}"
-        else:  # detailed
-            file_size_mb = file_path.stat().st_size / (1024 * 1024)
-            created_date = datetime.fromtimestamp(file_path.stat().st_ctime).strftime("%Y-%m-%d %H:%M")
-            upload_date = datetime.now().strftime("%Y-%m-%d %H:%M")
+        try:
+            # Generate caption
+            caption_mode = config.get("upload_caption", "detailed")
+            if caption_mode == "none":
+                caption = ""
+            elif caption_mode == "minimal":
+                caption = f"📦 {file_path.name}"
+            else:  # detailed
+                st = file_path.stat()
+                file_size_mb = st.st_size / (1024 * 1024)
+                created_date = time.strftime("%Y-%m-%d %H:%M", time.localtime(st.st_ctime))
+                upload_date = datetime.now().strftime("%Y-%m-%d %H:%M")
             
-            # Detect if this is a split part and if it's encrypted
-            import re
-            part_match = re.search(r'\.7z\.(\d+)$', file_path.name)
-            is_encrypted = file_path.suffix == '.7z' or '.7z.' in file_path.name or file_path.name.endswith('.7z')
+                # Detect if this is a split part and if it's encrypted
+                name = file_path.name
+                part_match = _PART_RE.search(name)
+                is_encrypted = name.endswith('.7z') or '.7z.' in name
             
-            if part_match:
-                part_num = int(part_match.group(1))
-                # Count total parts in the same directory
-                base_name = re.sub(r'\.7z\.\d+$', '', file_path.name)
-                total_parts = len(list(file_path.parent.glob(f"{base_name}.7z.*")))
-                caption = f"📦 **Part {part_num} of {total_parts}**\n"
-                caption += f"**File:** {file_path.name}\n"
-            else:
-                caption = f"📦 **File:** {file_path.name}\n"
+                if part_match:
+                    part_num = int(part_match.group(1))
+                    # Count total parts in the same directory
+                    base_name = _STRIP_PART_RE.sub('', file_path.name)
+                    total_parts = count_split_parts(file_path.parent, base_name)
+                    cap = [f"📦 **Part {part_num} of {total_parts}**\n"]
+                    cap.append(f"**File:** {file_path.name}\n")
+                else:
+                    cap = [f"📦 **File:** {file_path.name}\n"]
             
-            caption += f"📊 **Size:** {file_size_mb:.2f} MB\n"
+                cap.append(f"📊 **Size:** {file_size_mb:.2f} MB\n")
             
-            if is_encrypted:
-                caption += f"🔒 **Encrypted:** Yes\n"
-                try:
-                    contents = list_archive_contents(str(file_path), config.get('password'))
-                    if contents:
-                        caption += f"\n📁 **Archive Contents:**\n"
-                        for item in contents[:10]:
-                            # Get original file metadata if it's a video
-                            file_name = item['name']
-                            file_size_str = item['size']
+                if is_encrypted:
+                    cap.append(f"🔒 **Encrypted:** Yes\n")
+                    try:
+                        contents = await asyncio.to_thread(cached_list_archive_contents, file_path, config.get('password'))
+                        if contents:
+                            cap.append(f"\n📁 **Archive Contents:**\n")
+                            # Probe every listed video that is still in the workspace in one go
+                            video_paths = {}
+                            name_index = await asyncio.to_thread(workspace_name_index)  # Walks the workspace on a cache miss
+                            for item in contents[:10]:
+                                if item['name'].lower().endswith(VIDEO_EXTENSIONS):
+                                    found = name_index.get(item['name'])
+                                    if found is not None and found[1] >= PROBE_MIN_SIZE:
+                                        video_paths[item['name']] = found[0]
+                            probed = await probe_videos(video_paths.values()) if video_paths else {}
+                        
+                            for item in contents[:10]:
+                                file_name = item['name']
+                                file_size_str = item['size']
+                                metadata = probed.get(video_paths.get(file_name))
+                                video_stream = None
+                                if metadata:
+                                    video_stream = next((s for s in metadata.get('streams', []) if s.get('codec_type') == 'video'), None)
                             
-                            # Try to get video metadata
-                            if file_name.lower().endswith(('.mp4', '.avi', '.mkv', '.mov', '.flv', '.wmv', '.webm')):
-                                # Try to find the original file to get metadata
-                                original_path = WORKSPACE_DIR / file_name
-                                if original_path.exists():
-                                    try:
-                                        import subprocess
-                                        result = subprocess.run(
-                                            ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', str(original_path)],
-                                            capture_output=True, text=True, timeout=5
-                                        )
-                                        if result.returncode == 0:
-                                            import json
-                                            metadata = json.loads(result.stdout)
-                                            
-                                            # Extract video info
-                                            video_stream = next((s for s in metadata.get('streams', []) if s.get('codec_type') == 'video'), None)
-                                            format_info = metadata.get('format', {})
-                                            
-                                            if video_stream:
-                                                width = video_stream.get('width', 'N/A')
-                                                height = video_stream.get('height', 'N/A')
-                                                codec = video_stream.get('codec_name', 'N/A')
-                                                duration = float(format_info.get('duration', 0))
-                                                duration_str = f"{int(duration//60)}:{int(duration%60):02d}" if duration > 0 else 'N/A'
-                                                
-                                                caption += f"  🎬 **{file_name}** ({file_size_str})\n"
-                                                caption += f"     • Resolution: {width}x{height}\n"
-                                                caption += f"     • Codec: {codec}\n"
-                                                caption += f"     • Duration: {duration_str}\n"
-                                            else:
-                                                caption += f"  • {file_name} ({file_size_str})\n"
-                                        else:
-                                            caption += f"  • {file_name} ({file_size_str})\n"
-                                    except:
-                                        caption += f"  • {file_name} ({file_size_str})\n"
+                                if video_stream:
+                                    width = video_stream.get('width', 'N/A')
+                                    height = video_stream.get('height', 'N/A')
+                                    codec = video_stream.get('codec_name', 'N/A')
+                                    duration = float(metadata.get('format', {}).get('duration', 0))
+                                    duration_str = f"{int(duration//60)}:{int(duration%60):02d}" if duration > 0 else 'N/A'
+                                
+                                    cap.append(f"  🎬 **{file_name}** ({file_size_str})\n")
+                                    cap.append(f"     • Resolution: {width}x{height}\n")
+                                    cap.append(f"     • Codec: {codec}\n")
+                                    cap.append(f"     • Duration: {duration_str}\n")
                                 else:
-                                    caption += f"  • {file_name} ({file_size_str})\n"
-                            else:
-                                caption += f"  • {file_name} ({file_size_str})\n"
+                                    cap.append(f"  • {file_name} ({file_size_str})\n")
                         
-                        if len(contents) > 10:
-                            caption += f"  ... and {len(contents) - 10} more\n"
-                except:
-                    pass
-            else:
-                caption += f"⚠️ **Encrypted:** No (Unprotected)\n"
+                            if len(contents) > 10:
+                                cap.append(f"  ... and {len(contents) - 10} more\n")
+                    except:
+                        pass
+                else:
+                    cap.append(f"⚠️ **Encrypted:** No (Unprotected)\n")
             
-            caption += f"\n📅 **Created:** {created_date}\n"
-            caption += f"⬆️ **Uploaded:** {upload_date}"
+                cap.append(f"\n📅 **Created:** {created_date}\n")
+                cap.append(f"⬆️ **Uploaded:** {upload_date}")
+                caption = "".join(cap)
+        except BaseException:
+            # The caption failed; don't leave the upload running with nobody to await it
+            upload.cancel()
+            await asyncio.gather(upload, return_exceptions=True)
+            raise
+        
+        uploaded_file, file_size = await upload
         
         # Send to Telegram
         media = InputMediaUploadedDocument(
@@ -795,11 +1157,8 @@ async def upload_single_file(file_path, destination, job_id):
             media=media,
             message=caption
         ))
-        
-        await client.disconnect()
     except Exception as e:
         add_progress_log(job_id, f'[ERROR] Upload exception: {str(e)}', 'error')
-        import traceback
         add_progress_log(job_id, f'[ERROR] Traceback: {traceback.format_exc()}', 'error')
         raise
 
@@ -815,7 +1174,14 @@ def telegram_upload_raw():
     if not config.get('telegram_api_id') or not config.get('telegram_api_hash'):
         return jsonify({'error': 'Telegram credentials not set'}), 400
     
-    file_paths = [WORKSPACE_DIR / f for f in files if (WORKSPACE_DIR / f).exists()]
+    # Stat each file once; the result is reused for the size check and captions
+    file_stats = {}
+    for f in files:
+        try:
+            file_stats[WORKSPACE_DIR / f] = (WORKSPACE_DIR / f).stat()
+        except OSError:
+            continue
+    file_paths = list(file_stats)
     if not file_paths:
         return jsonify({'error': 'No valid files'}), 400
     
@@ -824,8 +1190,8 @@ def telegram_upload_raw():
     split_size_bytes = split_size_mb * 1024 * 1024
     oversized_files = []
     
-    for file_path in file_paths:
-        file_size_bytes = file_path.stat().st_size
+    for file_path, st in file_stats.items():
+        file_size_bytes = st.st_size
         if file_size_bytes > split_size_bytes:
             file_size_mb = file_size_bytes / (1024 * 1024)
             oversized_files.append(f"{file_path.name} ({file_size_mb:.0f}MB)")
@@ -834,76 +1200,50 @@ def telegram_upload_raw():
         error_msg = f"Cannot upload raw files larger than {split_size_mb}MB. Files exceeding limit: {', '.join(oversized_files)}. Enable 'Bundle' or 'Encrypt' to split large files."
         return jsonify({'error': error_msg}), 400
     
-    progress_data[job_id] = f"Uploading {len(file_paths)} raw file(s) to Telegram..."
-    progress_logs[job_id] = [
+    set_progress(job_id, f"Uploading {len(file_paths)} raw file(s) to Telegram...")
+    init_progress_logs(job_id, [
         {'msg': f'[UPLOAD] Starting upload of {len(file_paths)} raw file(s)...', 'type': 'info'}
-    ]
+    ])
     
-    def upload_task():
+    async def upload_task():
         try:
             async def upload_with_progress():
-                from telethon import TelegramClient
-                from telethon.tl.functions.messages import SendMediaRequest
-                from telethon.tl.types import InputMediaUploadedDocument, DocumentAttributeFilename
-                from parallel_upload import parallel_upload_file
                 
-                session_file = WORKSPACE_DIR.parent / "dailyarchive_session"
-                client = TelegramClient(
-                    str(session_file),
-                    int(config['telegram_api_id']),
-                    config['telegram_api_hash']
-                )
+                client = await get_shared_client()
                 
-                await client.start()
+                dest = await resolve_destination(client, custom_dest or config.get('upload_destination', 'me'))
                 
-                dest = custom_dest if custom_dest else config.get('upload_destination', 'me')
-                if dest != "me" and dest.lstrip('-').isdigit():
-                    dest = int(dest)
+                max_connections = config.get('parallel_connections', 20)
+                caption_mode = config.get("upload_caption", "detailed")
+                total = len(file_paths)
+                upload_date = datetime.now().strftime("%Y-%m-%d %H:%M")
                 
                 for i, file_path in enumerate(file_paths, 1):
-                    add_progress_log(job_id, f'[{i}/{len(file_paths)}] Uploading {file_path.name}...', 'info')
+                    add_progress_log(job_id, f'[{i}/{total}] Uploading {file_path.name}...', 'info')
                     
-                    import time
-                    start_time = time.time()
-                    last_update = [start_time]
-                    last_bytes = [0]
-                    
-                    def file_progress(current, total):
-                        now = time.time()
-                        elapsed = now - last_update[0]
-                        
-                        if elapsed >= 0.5:
-                            bytes_diff = current - last_bytes[0]
-                            speed_mbps = (bytes_diff / elapsed) / (1024 * 1024)
-                            last_update[0] = now
-                            last_bytes[0] = current
-                            
-                            percent = (current / total) * 100
-                            progress_data[job_id] = f"Uploading [{i}/{len(file_paths)}]: {percent:.1f}% ({speed_mbps:.2f} MB/s) - {file_path.name}"
+                    file_progress = throttled_progress(job_id, f"Uploading [{i}/{total}]", file_path.name)
                     
                     uploaded_file, _ = await parallel_upload_file(
                         client, str(file_path), file_progress,
-                        max_connections=config.get('parallel_connections', 20)
+                        max_connections=max_connections
                     )
                     
                     # Generate caption
-                    caption_mode = config.get("upload_caption", "detailed")
-                    
                     if caption_mode == "none":
                         caption = ""
                     elif caption_mode == "minimal":
                         caption = f"📄 {file_path.name}"
                     else:  # detailed
-                        from datetime import datetime
-                        file_size = file_path.stat().st_size / (1024 * 1024)
-                        created_date = datetime.fromtimestamp(file_path.stat().st_ctime).strftime("%Y-%m-%d %H:%M")
-                        upload_date = datetime.now().strftime("%Y-%m-%d %H:%M")
+                        st = file_stats[file_path]
+                        file_size = st.st_size / (1024 * 1024)
+                        created_date = time.strftime("%Y-%m-%d %H:%M", time.localtime(st.st_ctime))
                         
-                        caption = f"📄 {file_path.name}\n"
-                        caption += f"📊 Size: {file_size:.1f} MB\n"
-                        caption += f"⚠️ Encrypted: No (Unprotected)\n"
-                        caption += f"📅 Created: {created_date}\n"
-                        caption += f"⬆️ Uploaded: {upload_date}"
+                        cap = [f"📄 {file_path.name}\n"]
+                        cap.append(f"📊 Size: {file_size:.1f} MB\n")
+                        cap.append(f"⚠️ Encrypted: No (Unprotected)\n")
+                        cap.append(f"📅 Created: {created_date}\n")
+                        cap.append(f"⬆️ Uploaded: {upload_date}")
+                        caption = "".join(cap)
                     
                     media = InputMediaUploadedDocument(
                         file=uploaded_file,
@@ -918,18 +1258,15 @@ def telegram_upload_raw():
                     ))
                     
                     add_progress_log(job_id, f'[OK] Uploaded {file_path.name}', 'success')
-                
-                await client.disconnect()
             
-            asyncio.run(upload_with_progress())
-            progress_data[job_id] = "COMPLETE"
+            await upload_with_progress()
+            set_progress(job_id, "COMPLETE")
             add_progress_log(job_id, f'[OK] Uploaded {len(file_paths)} file(s) successfully', 'success')
         except Exception as e:
-            progress_data[job_id] = f"ERROR: {str(e)}"
+            set_progress(job_id, f"ERROR: {str(e)}")
             add_progress_log(job_id, f'[ERROR] Upload failed: {str(e)}', 'error')
     
-    thread = threading.Thread(target=upload_task)
-    thread.start()
+    submit_telegram(run_upload_job(upload_task()))
     
     return jsonify({'success': True, 'job_id': job_id, 'files': len(file_paths)})
 
@@ -949,15 +1286,7 @@ def telegram_upload():
         return jsonify({'error': 'Folder not found'}), 404
     
     # Get archive files (check root and subfolders for separate files)
-    parts = sorted(folder_path.glob('*.7z.*'))
-    if not parts:
-        parts = sorted(folder_path.glob('*.7z'))
-    
-    # If no files in root, check subfolders (for separately processed files)
-    if not parts:
-        parts = sorted(folder_path.glob('**/*.7z'))
-        if not parts:
-            parts = sorted(folder_path.glob('**/*.7z.*'))
+    parts = find_archive_parts(folder_path)
     
     if not parts:
         return jsonify({'error': 'No archive files found'}), 404
@@ -989,142 +1318,114 @@ def telegram_upload_files():
 def _telegram_upload_files_internal(parts, custom_dest, job_id):
     """Internal function to upload files to Telegram"""
     # Initialize progress
-    progress_data[job_id] = f"Uploading {len(parts)} file(s) to Telegram..."
-    progress_logs[job_id] = [
+    set_progress(job_id, f"Uploading {len(parts)} file(s) to Telegram...")
+    init_progress_logs(job_id, [
         {'msg': f'[UPLOAD] Starting upload of {len(parts)} file(s) to Telegram...', 'type': 'info'}
-    ]
+    ])
     
-    def upload_task():
+    async def upload_task():
         try:
-            # Track progress
-            current_file = [0]  # Use list to allow modification in nested function
-            
             async def upload_with_progress():
-                from telethon import TelegramClient
-                from telethon.tl.functions.messages import SendMediaRequest
-                from telethon.tl.types import InputMediaUploadedDocument, DocumentAttributeFilename
-                from parallel_upload import parallel_upload_file
-                
-                # Session file stays in root, not workspace
-                session_file = WORKSPACE_DIR.parent / "dailyarchive_session"
-                client = TelegramClient(
-                    str(session_file),
-                    int(config['telegram_api_id']),
-                    config['telegram_api_hash']
-                )
                 
-                await client.start()
+                client = await get_shared_client()
                 
-                # Convert destination to int if it's a channel ID
                 # Use custom destination if provided, otherwise use default from config
-                dest = custom_dest if custom_dest else config.get('upload_destination', 'me')
-                if dest != "me" and dest.lstrip('-').isdigit():
-                    dest = int(dest)
+                dest = await resolve_destination(client, custom_dest or config.get('upload_destination', 'me'))
                 
-                for i, part in enumerate(parts, 1):
-                    current_file[0] = i
-                    add_progress_log(job_id, f'[{i}/{len(parts)}] Uploading {part.name}...', 'info')
-                    
-                    import time
-                    start_time = time.time()
-                    last_update = [start_time]
-                    last_bytes = [0]
-                    
-                    def file_progress(current, total):
-                        now = time.time()
-                        elapsed = now - last_update[0]
-                        
-                        if elapsed >= 0.5:
-                            bytes_diff = current - last_bytes[0]
-                            speed_mbps = (bytes_diff / elapsed) / (1024 * 1024)
-                            last_bytes[0] = current
-                            
-                            percent = (current / total) * 100
-                            progress_data[job_id] = f"Uploading [{i}/{len(parts)}]: {percent:.1f}% ({speed_mbps:.2f} MB/s) - {part.name}"
-                    
-                    uploaded_file, _ = await parallel_upload_file(
-                        client, str(part), file_progress,
-                        max_connections=config.get('parallel_connections', 20)
-                    )
-                    
+                parts_by_base = {}  # (folder, archive name) -> number of split parts on disk
+                
+                # Upload a few parts at once; split the connection budget between them
+                parallel_files = max(1, int(config.get('parallel_files', 3)))
+                max_connections = max(1, config.get('parallel_connections', 20) // parallel_files)
+                sem = asyncio.Semaphore(parallel_files)
+                caption_mode = config.get("upload_caption", "detailed")
+                password = config.get('password')
+                total = len(parts)
+                upload_date = datetime.now().strftime("%Y-%m-%d %H:%M")
+                
+                async def part_caption(part):
                     # Generate caption based on settings
-                    caption_mode = config.get("upload_caption", "detailed")
-                    
                     if caption_mode == "none":
                         caption = ""
                     elif caption_mode == "minimal":
                         caption = f"📦 {part.name}"
                     else:  # detailed
-                        from datetime import datetime
-                        file_size = part.stat().st_size / (1024 * 1024)
-                        created_date = datetime.fromtimestamp(part.stat().st_ctime).strftime("%Y-%m-%d %H:%M")
-                        upload_date = datetime.now().strftime("%Y-%m-%d %H:%M")
+                        st = part.stat()
+                        file_size = st.st_size / (1024 * 1024)
+                        created_date = time.strftime("%Y-%m-%d %H:%M", time.localtime(st.st_ctime))
                         
                         parent_folder = part.parent.name
                         
                         # Detect if encrypted based on file extension
-                        is_encrypted = part.suffix == '.7z' or '.7z.' in part.name
+                        is_encrypted = part.name.endswith('.7z') or '.7z.' in part.name
                         
                         # Detect if this is a split part
-                        import re
-                        part_match = re.search(r'\.7z\.(\d+)$', part.name)
+                        part_match = _PART_RE.search(part.name)
                         if part_match:
                             part_num = int(part_match.group(1))
-                            base_name = re.sub(r'\.7z\.\d+$', '', part.name)
-                            total_parts = len(list(part.parent.glob(f"{base_name}.7z.*")))
-                            caption = f"📦 Part {part_num} of {total_parts}\n"
+                            base_name = _STRIP_PART_RE.sub('', part.name)
+                            key = (part.parent, base_name)
+                            total_parts = parts_by_base.get(key) or parts_by_base.setdefault(key, count_split_parts(part.parent, base_name))
+                            cap = [f"📦 Part {part_num} of {total_parts}\n"]
                         else:
-                            caption = f"📦 {part.name}\n"
+                            cap = [f"📦 {part.name}\n"]
                         
-                        caption += f"📁 Archive: {part.name}\n"
+                        cap.append(f"📁 Archive: {part.name}\n")
                         
                         # Try to get source from parent folder structure
                         try:
                             relative_path = part.relative_to(WORKSPACE_DIR)
                             if len(relative_path.parts) > 1:
                                 source_hint = str(relative_path.parent)
-                                caption += f"📂 Source: {source_hint}\n"
+                                cap.append(f"📂 Source: {source_hint}\n")
                         except:
                             pass
                         
-                        caption += f"📊 Size: {file_size:.1f} MB\n"
+                        cap.append(f"📊 Size: {file_size:.1f} MB\n")
                         
                         # Check if encrypted
                         if is_encrypted:
-                            caption += f"🔒 Encrypted: Yes\n"
+                            cap.append(f"🔒 Encrypted: Yes\n")
                         else:
-                            caption += f"Encrypted: No (Unprotected)\n"
+                            cap.append(f"Encrypted: No (Unprotected)\n")
                         
-                        # List archive contents if encrypted
-                        if is_encrypted:
+                        # List archive contents if encrypted (7z can only open a split set from its first part)
+                        if is_encrypted and (not part_match or part_num == 1):
                             try:
-                                from encryption import list_archive_contents
-                                password = config.get('password')
                                 if password:
-                                    contents = list_archive_contents(str(part), password)
+                                    contents = await asyncio.to_thread(cached_list_archive_contents, part, password)
                                     if contents:
-                                        caption += f"\nContents ({len(contents)} file(s)):\n"
+                                        cap.append(f"\nContents ({len(contents)} file(s)):\n")
                                         for file_info in contents[:10]:
-                                            try:
-                                                size_bytes = int(file_info['size'])
-                                                if size_bytes < 1024:
-                                                    size_str = f"{size_bytes} B"
-                                                elif size_bytes < 1024 * 1024:
-                                                    size_str = f"{size_bytes / 1024:.1f} KB"
-                                                else:
-                                                    size_str = f"{size_bytes / (1024 * 1024):.1f} MB"
-                                            except:
-                                                size_str = file_info['size']
-                                            
-                                            caption += f"• {file_info['name']} ({size_str})\n"
+                                            cap.append(f"• {file_info['name']} ({format_size(file_info['size'])})\n")
                                         
                                         if len(contents) > 10:
-                                            caption += f"... and {len(contents) - 10} more\n"
+                                            cap.append(f"... and {len(contents) - 10} more\n")
                             except:
                                 pass
                         
-                        caption += f"\n� Createed: {created_date}\n"
-                        caption += f"⬆️ Uploaded: {upload_date}"
+                        cap.append(f"\n� Createed: {created_date}\n")
+                        cap.append(f"⬆️ Uploaded: {upload_date}")
+                        caption = "".join(cap)
+                    return caption
+                
+                async def upload_one(i, part, previous):
+                    async with sem:
+                        add_progress_log(job_id, f'[{i}/{total}] Uploading {part.name}...', 'info')
+                        
+                        file_progress = throttled_progress(job_id, f"Uploading [{i}/{total}]", part.name)
+                        
+                        # Build the caption while the part uploads
+                        upload = asyncio.create_task(parallel_upload_file(
+                            client, str(part), file_progress,
+                            max_connections=max_connections
+                        ))
+                        try:
+                            caption = await part_caption(part)
+                        except BaseException:
+                            upload.cancel()
+                            raise
+                        uploaded_file, _ = await upload
                     
                     media = InputMediaUploadedDocument(
                         file=uploaded_file,
@@ -1132,25 +1433,39 @@ def _telegram_upload_files_internal(parts, custom_dest, job_id):
                         attributes=[DocumentAttributeFilename(part.name)],
                     )
                     
+                    # Each send waits for the one before it so parts arrive in order
+                    if previous is not None:
+                        await previous
                     await client(SendMediaRequest(
                         peer=dest,
                         media=media,
                         message=caption
                     ))
-                    
                     add_progress_log(job_id, f'[OK] Uploaded {part.name}', 'success')
                 
-                await client.disconnect()
+                tasks = []
+                previous = None
+                for i, part in enumerate(parts, 1):
+                    previous = asyncio.create_task(upload_one(i, part, previous))
+                    tasks.append(previous)
+                
+                try:
+                    await asyncio.gather(*tasks)
+                except Exception:
+                    # A failed part fails the job; stop the others and let them close their connections
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
             
-            asyncio.run(upload_with_progress())
-            progress_data[job_id] = "COMPLETE"
+            await upload_with_progress()
+            set_progress(job_id, "COMPLETE")
             add_progress_log(job_id, f'[OK] Uploaded {len(parts)} file(s) successfully', 'success')
         except Exception as e:
-            progress_data[job_id] = f"ERROR: {str(e)}"
+            set_progress(job_id, f"ERROR: {str(e)}")
             add_progress_log(job_id, f'[ERROR] Upload failed: {str(e)}', 'error')
     
-    thread = threading.Thread(target=upload_task)
-    thread.start()
+    submit_telegram(run_upload_job(upload_task()))
     
     return jsonify({'success': True, 'job_id': job_id, 'parts': len(parts)})
 
@@ -1183,7 +1498,6 @@ def decrypt():
 @app.route('/generate-passphrase')
 def generate_passphrase():
     """Generate a BIP39-style 12-word mnemonic"""
-    from mnemonic import Mnemonic
     mnemo = Mnemonic("english")
     words = mnemo.generate(strength=128)  # 128 bits = 12 words
     # Replace spaces with hyphens
@@ -1204,7 +1518,6 @@ def save_old_password():
         password_file = WORKSPACE_DIR / 'old_passwords.txt'
         
         # Append with timestamp
-        from datetime import datetime
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
         with open(password_file, 'a', encoding='utf-8') as f:
@@ -1255,6 +1568,7 @@ def settings():
     """Settings page"""
     if request.method == 'POST':
         data = request.json
+        old_credentials = (config.get('telegram_api_id'), config.get('telegram_api_hash'))
         
         if 'password' in data:
             config['password'] = data['password']
@@ -1274,9 +1588,16 @@ def settings():
             config['cpu_preset'] = data['cpu_preset']
         if 'cpu_threads' in data:
             config['cpu_threads'] = data['cpu_threads']
+        if 'video_encoder' in data:
+            config['video_encoder'] = data['video_encoder']
         if 'parallel_connections' in data:
             config['parallel_connections'] = data['parallel_connections']
         
+        # The shared upload client is bound to the old credentials
+        if (config.get('telegram_api_id'), config.get('telegram_api_hash')) != old_credentials:
+            reset_client()
+            invalidate_login_status()
+        
         save_config()
         return jsonify({'success': True})
     
@@ -1286,9 +1607,8 @@ def settings():
 def logout():
     """Logout from Telegram and delete session"""
     try:
-        session_file = WORKSPACE_DIR.parent / "dailyarchive_session.session"
-        if session_file.exists():
-            session_file.unlink()
+        delete_session()
+        invalidate_login_status()
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1302,15 +1622,12 @@ def reset():
         if old_password:
             old_passwords_file = WORKSPACE_DIR / "old_passwords.txt"
             with open(old_passwords_file, 'a', encoding='utf-8') as f:
-                from datetime import datetime
                 timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 f.write(f"[{timestamp}] {old_password}\n")
         
-        session_file = WORKSPACE_DIR.parent / "dailyarchive_session.session"
-        if session_file.exists():
-            session_file.unlink()
+        delete_session()
+        invalidate_login_status()
         
-        from config import DEFAULT_CONFIG
         config.clear()
         config.update(DEFAULT_CONFIG)
         save_config()
@@ -1319,17 +1636,56 @@ def reset():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Per-folder summaries for /folders and /downloaded: path -> (mtime_ns, computed at, summary)
+_dir_summary_cache = {}
+
+def cached_dir_summary(entry, summarize):
+    """Return summarize(path) for a DirEntry, reused while the folder's mtime is unchanged"""
+    mtime = entry.stat().st_mtime_ns
+    now = time.time()
+    hit = _dir_summary_cache.get(entry.path)
+    # The TTL catches changes deeper down (or files still growing) that don't touch the folder's mtime
+    if hit is not None and hit[0] == mtime and now - hit[1] < FILES_CACHE_TTL:
+        return hit[2]
+    summary = summarize(entry.path)
+    _dir_summary_cache[entry.path] = (mtime, now, summary)
+    return summary
+
+def count_archive_files(path):
+    """Count split parts in a folder, or whole archives if it has no parts"""
+    parts = archives = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                continue
+            if '.7z.' in entry.name:
+                parts += 1
+            elif entry.name.endswith('.7z'):
+                archives += 1
+    return parts or archives
+
+def folder_totals(path):
+    """Return (file count, total bytes) for everything under a folder"""
+    count = size = 0
+    for _, st in scan_files(path):
+        count += 1
+        size += st.st_size
+    return count, size
+
 @app.route('/folders')
 def list_folders():
     """List processed folders"""
     folders = []
-    for item in WORKSPACE_DIR.iterdir():
-        if item.is_dir() and item.name[0].isdigit():
-            parts = list(item.glob('*.7z.*')) or list(item.glob('*.7z'))
+    with os.scandir(WORKSPACE_DIR) as it:
+        for entry in it:
+            # Cheap name check first; d_type answers is_dir without a stat
+            if not entry.name[0].isdigit() or not entry.is_dir(follow_symlinks=False):
+                continue
+            st = entry.stat()  # Cached on the entry, shared with cached_dir_summary
             folders.append({
-                'name': item.name,
-                'files': len(parts),
-                'created': datetime.fromtimestamp(item.stat().st_ctime).strftime('%Y-%m-%d %H:%M')
+                'name': entry.name,
+                'files': cached_dir_summary(entry, count_archive_files),
+                'created': time.strftime('%Y-%m-%d %H:%M', time.localtime(st.st_ctime))
             })
     return jsonify(sorted(folders, key=lambda x: x['name'], reverse=True))
 
@@ -1340,12 +1696,7 @@ def telegram_archives():
         return jsonify({'error': 'Telegram credentials not set'}), 400
     
     try:
-        archives = asyncio.run(fetch_telegram_archives(
-            config['telegram_api_id'],
-            config['telegram_api_hash'],
-            config.get('upload_destination', 'me'),
-            WORKSPACE_DIR
-        ))
+        archives = run_async(fetch_telegram_archives(config.get('upload_destination', 'me')))
         return jsonify({'success': True, 'archives': archives})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1358,16 +1709,12 @@ def telegram_channels():
     
     try:
         async def get_channels():
-            from telethon.tl.types import Channel
-            
-            client = create_telegram_client(config['telegram_api_id'], config['telegram_api_hash'])
             
-            # Connect without starting (no interactive prompts)
-            await client.connect()
+            # Connected without starting (no interactive prompts)
+            client = await get_client()
             
             # Check if already authorized
             if not await client.is_user_authorized():
-                await client.disconnect()
                 return {'error': 'Not logged in. Please login first.', 'needs_login': True}
             
             channels = []
@@ -1394,16 +1741,23 @@ def telegram_channels():
                         }
                         channels.append(channel_info)
             
-            await client.disconnect()
             return {'success': True, 'channels': channels}
         
-        result = asyncio.run(get_channels())
+        result = run_async(get_channels())
         if 'needs_login' in result:
             return jsonify(result), 401
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+LOGIN_STATUS_TTL = 30  # seconds a /telegram-login-status answer is reused
+
+_login_status = {'at': 0, 'value': None}  # Last successful status check
+
+def invalidate_login_status():
+    """Make the next /telegram-login-status ask Telegram again"""
+    _login_status['at'] = 0
+
 @app.route('/telegram-login-send-code', methods=['POST'])
 def telegram_login_send_code():
     """Send OTP code to phone number"""
@@ -1418,19 +1772,15 @@ def telegram_login_send_code():
     
     try:
         async def send_code():
-            client = create_telegram_client(config['telegram_api_id'], config['telegram_api_hash'])
-            
-            await client.connect()
+            client = await get_client()
             
             # Send code request
             result = await client.send_code_request(phone)
             phone_code_hash = result.phone_code_hash
             
-            await client.disconnect()
-            
             return {'success': True, 'phone_code_hash': phone_code_hash}
         
-        result = asyncio.run(send_code())
+        result = run_async(send_code())
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1451,9 +1801,7 @@ def telegram_login_verify():
     
     try:
         async def verify_code():
-            client = create_telegram_client(config['telegram_api_id'], config['telegram_api_hash'])
-            
-            await client.connect()
+            client = await get_client()
             
             # Sign in with code
             await client.sign_in(phone, code, phone_code_hash=phone_code_hash)
@@ -1461,12 +1809,13 @@ def telegram_login_verify():
             # Get user info
             me = await client.get_me()
             
-            # Ensure session is saved before disconnecting
-            await client.disconnect()
+            # Make sure the login is written to the session file
+            client.session.save()
             
             return {'success': True, 'user': {'id': me.id, 'name': f"{me.first_name} {me.last_name or ''}".strip()}}
         
-        result = asyncio.run(verify_code())
+        result = run_async(verify_code())
+        invalidate_login_status()
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1477,11 +1826,12 @@ def telegram_login_status():
     if not config.get('telegram_api_id') or not config.get('telegram_api_hash'):
         return jsonify({'logged_in': False, 'error': 'Telegram credentials not set'})
     
+    if _login_status['at'] and time.monotonic() - _login_status['at'] < LOGIN_STATUS_TTL:
+        return jsonify(_login_status['value'])
+    
     try:
         async def check_status():
-            client = create_telegram_client(config['telegram_api_id'], config['telegram_api_hash'])
-            
-            await client.connect()
+            client = await get_client()
             is_authorized = await client.is_user_authorized()
             
             user_info = None
@@ -1489,15 +1839,117 @@ def telegram_login_status():
                 me = await client.get_me()
                 user_info = {'id': me.id, 'name': f"{me.first_name} {me.last_name or ''}".strip(), 'phone': me.phone}
             
-            await client.disconnect()
-            
             return {'logged_in': is_authorized, 'user': user_info}
         
-        result = asyncio.run(check_status())
+        result = run_async(check_status())
+        _login_status['value'] = result
+        _login_status['at'] = time.monotonic()
         return jsonify(result)
     except Exception as e:
         return jsonify({'logged_in': False, 'error': str(e)})
 
+async def telegram_download_job(job_id, archive_id, decrypt, delete_after_decrypt):
+    """Background job: download an archive's parts and optionally decrypt them"""
+    try:
+        async def download_with_progress():
+            
+            client = await get_shared_client()
+            
+            dest = await resolve_destination(client, config.get('upload_destination', 'me'))
+            
+            # Create download folder inside archive/Downloaded/
+            downloads_root = WORKSPACE_DIR / "Downloaded"
+            downloads_root.mkdir(exist_ok=True)
+            download_dir = downloads_root / archive_id
+            download_dir.mkdir(exist_ok=True)
+            
+            # Fetch and download matching files; Telegram filters by name and type server-side
+            files_to_download = []
+            seen = set()
+            async for message in client.iter_messages(dest, search=archive_id, filter=InputMessagesFilterDocument):
+                if not message.file or not message.file.name:
+                    continue
+                filename = message.file.name
+                if filename in seen or not is_archive_file(filename, archive_id):
+                    continue
+                seen.add(filename)
+                files_to_download.append((message, filename))
+                
+                # A whole .7z is complete on its own; split parts may have been re-sent out of
+                # order after a failed upload, so those are collected in full
+                if filename.endswith('.7z'):
+                    break
+            files_to_download.sort(key=lambda item: item[1])
+            
+            if not files_to_download:
+                raise Exception(f"No files found for archive: {archive_id}")
+            
+            add_progress_log(job_id, f'[DOWNLOAD] Found {len(files_to_download)} file(s) to download', 'info')
+            
+            # Download each file with progress
+            for i, (message, filename) in enumerate(files_to_download, 1):
+                add_progress_log(job_id, f'[{i}/{len(files_to_download)}] Downloading {filename}...', 'info')
+                
+                # Use parallel download for speed
+                file_progress = throttled_progress(job_id, f"Downloading [{i}/{len(files_to_download)}]", filename)
+                
+                await parallel_download_file(client, message, str(download_dir / filename), file_progress)
+                add_progress_log(job_id, f'[OK] Downloaded {filename}', 'success')
+            
+            # Decrypt if requested
+            add_progress_log(job_id, f'[DEBUG] Decrypt flag is: {decrypt}', 'info')
+            if decrypt:
+                set_progress(job_id, "Decrypting archive...")
+                add_progress_log(job_id, '[DECRYPT] Starting decryption...', 'info')
+                
+                # Find the archive file - prioritize .7z.001 (split archives), then .7z files
+                # One scan, taken before extraction, also drives the cleanup below
+                with os.scandir(download_dir) as it:
+                    downloaded = sorted(Path(e.path) for e in it if e.is_file() and '.7z' in e.name)
+                archives = ([p for p in downloaded if p.name.endswith('.7z.001')]
+                            or [p for p in downloaded if p.name.endswith('.7z')])
+                
+                add_progress_log(job_id, f'[DEBUG] Found {len(archives)} archive(s) to decrypt', 'info')
+                if archives:
+                    add_progress_log(job_id, f'[DEBUG] Archives: {[a.name for a in archives]}', 'info')
+                    password = config.get('password')
+                    if not password:
+                        raise Exception("No password set for decryption")
+                    
+                    # Decrypt each archive found
+                    for archive in archives:
+                        add_progress_log(job_id, f'[DECRYPT] Decrypting {archive.name}...', 'info')
+                        
+                        def decrypt_progress(msg):
+                            set_progress(job_id, msg)
+                        
+                        # 7z blocks, so keep it off the shared Telegram loop
+                        success = await asyncio.to_thread(decrypt_and_extract, archive, download_dir, password, decrypt_progress)
+                        if success:
+                            add_progress_log(job_id, f'[OK] Decrypted {archive.name}', 'success')
+                        else:
+                            raise Exception(f"Decryption failed for {archive.name}")
+                    
+                    # Delete .7z files if requested
+                    if delete_after_decrypt:
+                        add_progress_log(job_id, '[CLEANUP] Deleting .7z files...', 'info')
+                        for archive_file in downloaded:
+                            archive_file.unlink()
+                        add_progress_log(job_id, '[OK] Deleted .7z files', 'success')
+                else:
+                    add_progress_log(job_id, '[WARNING] No .7z archives found to decrypt', 'warning')
+            
+            return download_dir
+        
+        path = await download_with_progress()
+        set_progress(job_id, "COMPLETE")
+        set_progress(f"{job_id}_result", {'path': str(path)})
+        add_progress_log(job_id, f'[OK] Download complete: {path.name}', 'success')
+    except Exception as e:
+        set_progress(job_id, f"ERROR: {str(e)}")
+        add_progress_log(job_id, f'[ERROR] Download failed: {str(e)}', 'error')
+
+
 @app.route('/telegram-download', methods=['POST'])
 def telegram_download():
     """Download archive from Telegram"""
@@ -1511,140 +1963,13 @@ def telegram_download():
         return jsonify({'error': 'Telegram credentials not set'}), 400
     
     # Initialize progress
-    progress_data[job_id] = f"Starting download of {archive_id}..."
-    progress_logs[job_id] = [
+    set_progress(job_id, f"Starting download of {archive_id}...")
+    init_progress_logs(job_id, [
         {'msg': f'[DOWNLOAD] Starting download of archive: {archive_id}', 'type': 'info'},
         {'msg': f'[DEBUG] Decrypt option: {decrypt}', 'type': 'info'}
-    ]
+    ])
     
-    def download_task():
-        try:
-            async def download_with_progress():
-                from telethon import TelegramClient
-                import re
-                
-                session_file = WORKSPACE_DIR.parent / "dailyarchive_session"
-                client = TelegramClient(str(session_file), int(config['telegram_api_id']), config['telegram_api_hash'])
-                
-                await client.start()
-                
-                # Convert destination
-                dest = config.get('upload_destination', 'me')
-                if dest != "me" and dest.lstrip('-').isdigit():
-                    dest = int(dest)
-                
-                # Create download folder inside archive/Downloaded/
-                downloads_root = WORKSPACE_DIR / "Downloaded"
-                downloads_root.mkdir(exist_ok=True)
-                download_dir = downloads_root / archive_id
-                download_dir.mkdir(exist_ok=True)
-                
-                # Fetch and download matching files
-                files_to_download = []
-                async for message in client.iter_messages(dest, limit=1000):
-                    if message.document and message.file.name:
-                        filename = message.file.name
-                        match = re.match(r'(.+?)\.7z(?:\.(\d+))?$', filename)
-                        
-                        if match and match.group(1) == archive_id:
-                            files_to_download.append((message, filename))
-                
-                if not files_to_download:
-                    raise Exception(f"No files found for archive: {archive_id}")
-                
-                add_progress_log(job_id, f'[DOWNLOAD] Found {len(files_to_download)} file(s) to download', 'info')
-                
-                # Download each file with progress
-                for i, (message, filename) in enumerate(files_to_download, 1):
-                    file_size = message.file.size
-                    
-                    def file_progress(current, total):
-                        import time
-                        percent = (current / total) * 100
-                        speed_mbps = 0  # Calculate if needed
-                        progress_data[job_id] = f"Downloading [{i}/{len(files_to_download)}]: {percent:.1f}% - {filename}"
-                    
-                    add_progress_log(job_id, f'[{i}/{len(files_to_download)}] Downloading {filename}...', 'info')
-                    
-                    # Use parallel download for speed
-                    from parallel_upload import parallel_download_file
-                    import time
-                    start_time = time.time()
-                    last_update = [start_time]
-                    last_bytes = [0]
-                    
-                    def file_progress(current, total):
-                        now = time.time()
-                        elapsed = now - last_update[0]
-                        
-                        # Update speed every 0.5 seconds
-                        if elapsed >= 0.5:
-                            bytes_diff = current - last_bytes[0]
-                            speed_mbps = (bytes_diff / elapsed) / (1024 * 1024)  # MB/s
-                            last_update[0] = now
-                            last_bytes[0] = current
-                            
-                            percent = (current / total) * 100
-                            progress_data[job_id] = f"Downloading [{i}/{len(files_to_download)}]: {percent:.1f}% ({speed_mbps:.2f} MB/s) - {filename}"
-                    
-                    await parallel_download_file(client, message, str(download_dir / filename), file_progress)
-                    add_progress_log(job_id, f'[OK] Downloaded {filename}', 'success')
-                
-                await client.disconnect()
-                
-                # Decrypt if requested
-                add_progress_log(job_id, f'[DEBUG] Decrypt flag is: {decrypt}', 'info')
-                if decrypt:
-                    progress_data[job_id] = "Decrypting archive..."
-                    add_progress_log(job_id, '[DECRYPT] Starting decryption...', 'info')
-                    
-                    # Find the archive file - prioritize .7z.001 (split archives), then .7z files
-                    archives = list(download_dir.glob('*.7z.001'))
-                    if not archives:
-                        archives = list(download_dir.glob('*.7z'))
-                    
-                    add_progress_log(job_id, f'[DEBUG] Found {len(archives)} archive(s) to decrypt', 'info')
-                    if archives:
-                        add_progress_log(job_id, f'[DEBUG] Archives: {[a.name for a in archives]}', 'info')
-                        from encryption import decrypt_and_extract
-                        password = config.get('password')
-                        if not password:
-                            raise Exception("No password set for decryption")
-                        
-                        # Decrypt each archive found
-                        for archive in archives:
-                            add_progress_log(job_id, f'[DECRYPT] Decrypting {archive.name}...', 'info')
-                            
-                            def decrypt_progress(msg):
-                                progress_data[job_id] = msg
-                            
-                            success = decrypt_and_extract(archive, download_dir, password, decrypt_progress)
-                            if success:
-                                add_progress_log(job_id, f'[OK] Decrypted {archive.name}', 'success')
-                            else:
-                                raise Exception(f"Decryption failed for {archive.name}")
-                        
-                        # Delete .7z files if requested
-                        if delete_after_decrypt:
-                            add_progress_log(job_id, '[CLEANUP] Deleting .7z files...', 'info')
-                            for archive_file in download_dir.glob('*.7z*'):
-                                archive_file.unlink()
-                            add_progress_log(job_id, '[OK] Deleted .7z files', 'success')
-                    else:
-                        add_progress_log(job_id, '[WARNING] No .7z archives found to decrypt', 'warning')
-                
-                return download_dir
-            
-            path = asyncio.run(download_with_progress())
-            progress_data[job_id] = "COMPLETE"
-            progress_data[f"{job_id}_result"] = {'path': str(path)}
-            add_progress_log(job_id, f'[OK] Download complete: {path.name}', 'success')
-        except Exception as e:
-            progress_data[job_id] = f"ERROR: {str(e)}"
-            add_progress_log(job_id, f'[ERROR] Download failed: {str(e)}', 'error')
-    
-    thread = threading.Thread(target=download_task)
-    thread.start()
+    submit_download(job_id, telegram_download_job(job_id, archive_id, decrypt, delete_after_decrypt))
     
     return jsonify({'success': True, 'job_id': job_id})
 
@@ -1658,13 +1983,7 @@ def telegram_delete():
         return jsonify({'error': 'Telegram credentials not set'}), 400
     
     try:
-        deleted = asyncio.run(delete_telegram_archive(
-            archive_id,
-            config['telegram_api_id'],
-            config['telegram_api_hash'],
-            config.get('upload_destination', 'me'),
-            WORKSPACE_DIR
-        ))
+        deleted = run_async(delete_telegram_archive(archive_id, config.get('upload_destination', 'me'), data.get('message_ids')))
         return jsonify({'success': True, 'deleted': deleted})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1679,6 +1998,11 @@ def delete_file():
         return jsonify({'error': 'No path provided'}), 400
     
     full_path = WORKSPACE_DIR / path
+    # Only ever delete inside the workspace, and never the workspace itself
+    workspace = WORKSPACE_DIR.resolve()
+    resolved = full_path.resolve()
+    if resolved == workspace or not resolved.is_relative_to(workspace):
+        return jsonify({'error': 'Path is outside the workspace'}), 403
     if not full_path.exists():
         return jsonify({'error': 'Path not found'}), 404
     
@@ -1686,12 +2010,76 @@ def delete_file():
         if full_path.is_file():
             full_path.unlink()
         else:
-            import shutil
             shutil.rmtree(full_path)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+async def telegram_download_single_job(job_id, archive_id, filename, message_id, decrypt, delete_after_decrypt):
+    """Background job: download a single file and optionally decrypt it"""
+    try:
+        async def download_with_progress():
+            
+            client = await get_shared_client()
+            
+            dest = await resolve_destination(client, config.get('upload_destination', 'me'))
+            
+            # Create download folder
+            downloads_root = WORKSPACE_DIR / "Downloaded"
+            downloads_root.mkdir(exist_ok=True)
+            download_dir = downloads_root / archive_id
+            download_dir.mkdir(exist_ok=True)
+            
+            # Get the specific message
+            message = await client.get_messages(dest, ids=message_id)
+            
+            if not message or not message.document:
+                raise Exception(f"File not found: {filename}")
+            
+            # Download with progress
+            file_progress = throttled_progress(job_id, "Downloading", filename)
+            
+            await parallel_download_file(client, message, str(download_dir / filename), file_progress)
+            add_progress_log(job_id, f'[OK] Downloaded {filename}', 'success')
+            
+            # Decrypt if requested and file is a .7z archive
+            if decrypt and (filename.endswith('.7z') or '.7z.' in filename):
+                set_progress(job_id, "Decrypting archive...")
+                add_progress_log(job_id, '[DECRYPT] Starting decryption...', 'info')
+                
+                password = config.get('password')
+                if not password:
+                    raise Exception("No password set for decryption")
+                
+                archive_path = download_dir / filename
+                add_progress_log(job_id, f'[DECRYPT] Decrypting {filename}...', 'info')
+                
+                def decrypt_progress(msg):
+                    set_progress(job_id, msg)
+                
+                success = await asyncio.to_thread(decrypt_and_extract, archive_path, download_dir, password, decrypt_progress)
+                if success:
+                    add_progress_log(job_id, f'[OK] Decrypted {filename}', 'success')
+                    
+                    # Delete .7z file if requested
+                    if delete_after_decrypt:
+                        add_progress_log(job_id, '[CLEANUP] Deleting .7z file...', 'info')
+                        archive_path.unlink()
+                        add_progress_log(job_id, '[OK] Deleted .7z file', 'success')
+                else:
+                    raise Exception(f"Decryption failed for {filename}")
+            
+            return download_dir
+        
+        path = await download_with_progress()
+        set_progress(job_id, "COMPLETE")
+        set_progress(f"{job_id}_result", {'path': str(path / filename)})
+        add_progress_log(job_id, f'[OK] Download complete: {archive_id}', 'success')
+    except Exception as e:
+        set_progress(job_id, f"ERROR: {str(e)}")
+        add_progress_log(job_id, f'[ERROR] Download failed: {str(e)}', 'error')
+
+
 @app.route('/telegram-download-single', methods=['POST'])
 def telegram_download_single():
     """Download a single file from Telegram"""
@@ -1707,107 +2095,25 @@ def telegram_download_single():
         return jsonify({'error': 'Telegram credentials not set'}), 400
     
     # Initialize progress
-    progress_data[job_id] = f"Starting download of {filename}..."
-    progress_logs[job_id] = [
+    set_progress(job_id, f"Starting download of {filename}...")
+    init_progress_logs(job_id, [
         {'msg': f'[DOWNLOAD] Starting download: {filename}', 'type': 'info'},
         {'msg': f'[DEBUG] Decrypt option: {decrypt}', 'type': 'info'}
-    ]
+    ])
     
-    def download_task():
-        try:
-            async def download_with_progress():
-                from telethon import TelegramClient
-                
-                session_file = WORKSPACE_DIR.parent / "dailyarchive_session"
-                client = TelegramClient(str(session_file), int(config['telegram_api_id']), config['telegram_api_hash'])
-                
-                await client.start()
-                
-                # Convert destination
-                dest = config.get('upload_destination', 'me')
-                if dest != "me" and dest.lstrip('-').isdigit():
-                    dest = int(dest)
-                
-                # Create download folder
-                downloads_root = WORKSPACE_DIR / "Downloaded"
-                downloads_root.mkdir(exist_ok=True)
-                download_dir = downloads_root / archive_id
-                download_dir.mkdir(exist_ok=True)
-                
-                # Get the specific message
-                message = await client.get_messages(dest, ids=message_id)
-                
-                if not message or not message.document:
-                    raise Exception(f"File not found: {filename}")
-                
-                # Download with progress
-                from parallel_upload import parallel_download_file
-                import time
-                start_time = time.time()
-                last_update = [start_time]
-                last_bytes = [0]
-                
-                def file_progress(current, total):
-                    now = time.time()
-                    elapsed = now - last_update[0]
-                    
-                    if elapsed >= 0.5:
-                        bytes_diff = current - last_bytes[0]
-                        speed_mbps = (bytes_diff / elapsed) / (1024 * 1024)
-                        last_update[0] = now
-                        last_bytes[0] = current
-                        
-                        percent = (current / total) * 100
-                        progress_data[job_id] = f"Downloading: {percent:.1f}% ({speed_mbps:.2f} MB/s) - {filename}"
-                
-                await parallel_download_file(client, message, str(download_dir / filename), file_progress)
-                add_progress_log(job_id, f'[OK] Downloaded {filename}', 'success')
-                
-                await client.disconnect()
-                
-                # Decrypt if requested and file is a .7z archive
-                if decrypt and (filename.endswith('.7z') or '.7z.' in filename):
-                    progress_data[job_id] = "Decrypting archive..."
-                    add_progress_log(job_id, '[DECRYPT] Starting decryption...', 'info')
-                    
-                    from encryption import decrypt_and_extract
-                    password = config.get('password')
-                    if not password:
-                        raise Exception("No password set for decryption")
-                    
-                    archive_path = download_dir / filename
-                    add_progress_log(job_id, f'[DECRYPT] Decrypting {filename}...', 'info')
-                    
-                    def decrypt_progress(msg):
-                        progress_data[job_id] = msg
-                    
-                    success = decrypt_and_extract(archive_path, download_dir, password, decrypt_progress)
-                    if success:
-                        add_progress_log(job_id, f'[OK] Decrypted {filename}', 'success')
-                        
-                        # Delete .7z file if requested
-                        if delete_after_decrypt:
-                            add_progress_log(job_id, '[CLEANUP] Deleting .7z file...', 'info')
-                            archive_path.unlink()
-                            add_progress_log(job_id, '[OK] Deleted .7z file', 'success')
-                    else:
-                        raise Exception(f"Decryption failed for {filename}")
-                
-                return download_dir
-            
-            path = asyncio.run(download_with_progress())
-            progress_data[job_id] = "COMPLETE"
-            progress_data[f"{job_id}_result"] = {'path': str(path / filename)}
-            add_progress_log(job_id, f'[OK] Download complete: {archive_id}', 'success')
-        except Exception as e:
-            progress_data[job_id] = f"ERROR: {str(e)}"
-            add_progress_log(job_id, f'[ERROR] Download failed: {str(e)}', 'error')
-    
-    thread = threading.Thread(target=download_task)
-    thread.start()
+    submit_download(job_id, telegram_download_single_job(job_id, archive_id, filename, message_id, decrypt, delete_after_decrypt))
     
     return jsonify({'success': True, 'job_id': job_id})
 
+@app.route('/cancel/<job_id>', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running download"""
+    future = download_jobs.get(job_id)
+    if future is None:
+        return jsonify({'error': 'No running download with that id'}), 404
+    future.cancel()
+    return jsonify({'success': True})
+
 @app.route('/downloaded')
 def list_downloaded():
     """List downloaded folders"""
@@ -1815,45 +2121,45 @@ def list_downloaded():
     folders = []
     
     if downloads_root.exists():
-        for item in downloads_root.iterdir():
-            if item.is_dir():
-                # Get folder info
-                files = list(item.rglob('*'))
-                file_count = sum(1 for f in files if f.is_file())
-                total_size = sum(f.stat().st_size for f in files if f.is_file())
-                
-                folders.append({
-                    'name': f"Downloaded/{item.name}",
-                    'display_name': item.name,
-                    'files': file_count,
-                    'size': round(total_size / (1024**3), 2),
-                    'created': datetime.fromtimestamp(item.stat().st_ctime).strftime('%Y-%m-%d %H:%M')
-                })
+        with os.scandir(downloads_root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    # Get folder info
+                    file_count, total_size = cached_dir_summary(entry, folder_totals)
+                    
+                    folders.append({
+                        'name': f"Downloaded/{entry.name}",
+                        'display_name': entry.name,
+                        'files': file_count,
+                        'size': round(total_size / (1024**3), 2),
+                        'created': time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.stat().st_ctime))
+                    })
     
     return jsonify(sorted(folders, key=lambda x: x['created'], reverse=True))
 
 if __name__ == '__main__':
-    import logging
-    import webbrowser
-    import threading
-    import os
-    
     log = logging.getLogger('werkzeug')
     log.setLevel(logging.ERROR)
     
-    # Only open browser and show message in the main process (not reloader)
-    if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
-        print("\n" + "="*60)
-        print("  TEL ARCHIVE - Starting server...")
-        print("  Opening browser at http://localhost:5001")
-        print("="*60 + "\n")
-        
-        def open_browser():
-            import time
-            time.sleep(1.5)
-            webbrowser.open('http://localhost:5001')
-        
-        threading.Thread(target=open_browser, daemon=True).start()
+    print("\n" + "="*60)
+    print("  TEL ARCHIVE - Starting server...")
+    print("  Opening browser at http://localhost:5001")
+    print("="*60 + "\n")
     
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    def open_browser():
+        time.sleep(1.5)
+        webbrowser.open('http://localhost:5001')
+    
+    threading.Thread(target=open_browser, daemon=True).start()
+    
+    # No reloader: it re-imports the app in a child process, which would start a second Telegram loop and client
+    if os.environ.get('TEL_ARCHIVE_DEV'):
+        app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5001)
+    else:
+        try:
+            from waitress import serve
+        except ImportError:
+            app.run(host='0.0.0.0', port=5001, threaded=True)
+        else:
+            serve(app, host='0.0.0.0', port=5001, threads=16)
 
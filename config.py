@@ -1,5 +1,5 @@
 """Configuration management"""
-import json
+import orjson
 from pathlib import Path
 
 WORKSPACE_DIR = Path.cwd() / "archive"
@@ -18,7 +18,11 @@ DEFAULT_CONFIG = {
     "video_keep_audio": True,
     "cpu_preset": "normal",
     "cpu_threads": 0,
-    "parallel_connections": 20
+    "video_encoder": "cpu",
+    "parallel_connections": 20,
+    "parallel_files": 3,
+    "max_concurrent_downloads": 2,
+    "max_concurrent_uploads": 4
 }
 
 # Map friendly names to ffmpeg preset names
@@ -37,10 +41,10 @@ config = {}
 def load_config():
     global config
     if CONFIG_FILE.exists():
-        with open(CONFIG_FILE, 'r') as f:
-            loaded = json.load(f)
-            config.clear()
-            config.update(loaded)
+        with open(CONFIG_FILE, 'rb') as f:
+            loaded = orjson.loads(f.read())
+        config.clear()
+        config.update(loaded)
     else:
         config.clear()
         config.update(DEFAULT_CONFIG)
@@ -51,8 +55,8 @@ def load_config():
     return config
 
 def save_config():
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=2)
+    with open(CONFIG_FILE, 'wb') as f:
+        f.write(orjson.dumps(config, option=orjson.OPT_INDENT_2))
     
     # Ensure workspace folder exists
     WORKSPACE_DIR.mkdir(exist_ok=True)
@@ -1,15 +1,55 @@
 """Encryption and archiving functions - simplified"""
+import os
 import subprocess
 import re
+import hashlib
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from config import config
 
+# Percentage in 7z -bsp1 progress output
+_PCT_RE = re.compile(r'(\d+)%')
+
+
+def _drain(stream, lines: list) -> threading.Thread:
+    """Collect a pipe's lines on a daemon thread, so 7z never stalls on a full stderr pipe"""
+    def read():
+        for line in stream:
+            lines.append(line)
+    
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    return thread
+
+
+def _print_7z_errors(process, reader, error_output):
+    """Print the tail of a failed 7z run's stderr"""
+    reader.join(timeout=1)
+    print(f"\n    [!] 7z failed with return code {process.returncode}")
+    for line in error_output[-10:]:
+        print(f"        {line.strip()}")
+
 
 def get_file_size_gb(file_path: Path) -> float:
     """Get file size in GB"""
     return file_path.stat().st_size / (1024 ** 3)
 
 
+_SIZE_UNITS = ((1 << 30, 'GB'), (1 << 20, 'MB'), (1 << 10, 'KB'))
+
+
+def format_size(size: str) -> str:
+    """Format a byte count from a 7z listing as B/KB/MB/GB; anything non-numeric is returned as is"""
+    if not size.isdigit():
+        return size
+    size_bytes = int(size)
+    for threshold, unit in _SIZE_UNITS:
+        if size_bytes >= threshold:
+            return f"{size_bytes / threshold:.1f} {unit}"
+    return f"{size_bytes} B"
+
+
 def list_archive_contents(archive_path: Path, password: str) -> list:
     """List contents of encrypted archive without extracting"""
     cmd = ["7z", "l", f"-p{password}", "-slt", str(archive_path)]
@@ -23,20 +63,18 @@ def list_archive_contents(archive_path: Path, password: str) -> list:
         current_file = {}
         is_folder = False
         
-        for line in result.stdout.split('\n'):
-            line = line.strip()
+        # -slt prints one "Key = Value" per line, with a blank line after each entry
+        for line in result.stdout.splitlines():
+            key, _, value = line.strip().partition(' = ')
             
-            if line.startswith('Path = '):
-                path = line.split(' = ', 1)[1]
-                if not path.endswith('.7z') and not path.endswith('.7z.001'):
-                    current_file['name'] = path
-            elif line.startswith('Size = '):
-                size = line.split(' = ', 1)[1]
-                current_file['size'] = size
-            elif line.startswith('Folder = '):
-                folder = line.split(' = ', 1)[1]
-                is_folder = (folder == '+')
-            elif line == '' and current_file.get('name'):
+            if key == 'Path':
+                if not value.endswith('.7z') and not value.endswith('.7z.001'):
+                    current_file['name'] = value
+            elif key == 'Size':
+                current_file['size'] = value
+            elif key == 'Folder':
+                is_folder = (value == '+')
+            elif not key and current_file.get('name'):
                 if not is_folder:
                     files.append(current_file.copy())
                 current_file = {}
@@ -47,9 +85,34 @@ def list_archive_contents(archive_path: Path, password: str) -> list:
         return []
 
 
+# LRU of archive listings; keys hold a short password digest, never the password itself
+_CONTENTS_CACHE_SIZE = 256
+_contents_cache = OrderedDict()
+_contents_cache_lock = threading.Lock()
+
+
+def cached_list_archive_contents(archive_path: Path, password: str) -> tuple:
+    """List archive contents, reusing the result while the file is unchanged"""
+    st = os.stat(archive_path)
+    pwd_digest = hashlib.blake2b((password or '').encode(), digest_size=8).digest()
+    key = (str(Path(archive_path).resolve()), st.st_mtime_ns, st.st_size, pwd_digest)
+    
+    with _contents_cache_lock:
+        if key in _contents_cache:
+            _contents_cache.move_to_end(key)
+            return _contents_cache[key]
+    
+    contents = tuple(list_archive_contents(archive_path, password))
+    with _contents_cache_lock:
+        _contents_cache[key] = contents
+        if len(_contents_cache) > _CONTENTS_CACHE_SIZE:
+            _contents_cache.popitem(last=False)
+    return contents
+
+
 def create_archive(input_files: list, output_dir: Path, archive_name: str, 
                    password: str = None, split_size_mb: int = None, 
-                   progress_callback=None):
+                   progress_callback=None, sizes: list = None):
     """
     Create 7z archive with optional encryption and splitting.
     
@@ -60,6 +123,7 @@ def create_archive(input_files: list, output_dir: Path, archive_name: str,
         password: Optional password for encryption
         split_size_mb: Optional split size in MB (None = no split)
         progress_callback: Optional callback for progress updates
+        sizes: Optional byte sizes of input_files, if the caller already has them
     
     Returns:
         Path to archive file, or list of paths if split
@@ -73,7 +137,9 @@ def create_archive(input_files: list, output_dir: Path, archive_name: str,
     # Add split if specified
     if split_size_mb:
         cmd.append(f"-v{split_size_mb}m")
-        total_size_gb = sum(f.stat().st_size for f in input_files) / (1024 ** 3)
+        if sizes is None:
+            sizes = [f.stat().st_size for f in input_files]
+        total_size_gb = sum(sizes) / (1024 ** 3)
         print(f"\n    Total size: {total_size_gb:.2f} GB")
         print(f"    Part size: {split_size_mb} MB\n")
     
@@ -81,20 +147,23 @@ def create_archive(input_files: list, output_dir: Path, archive_name: str,
     if password:
         cmd.extend([f"-p{password}", "-mhe=on"])
     
+    # Normal LZMA2 level with one thread per core; some 7z builds default to just two
+    cmd.extend(["-mx=5", f"-mmt={os.cpu_count() or 4}"])
+    
     cmd.extend(["-bsp1", str(archive_path)])
     cmd.extend([str(f) for f in input_files])
     
     # Run 7z
     process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    error_output = []
+    reader = _drain(process.stderr, error_output)
     
     last_percent = -1
     sent_completion = False
     
-    while True:
-        line = process.stdout.readline()
-        if not line and process.poll() is not None:
-            break
-        match = re.search(r'(\d+)%', line)
+    # Blocks in readline until 7z prints, instead of spinning on poll() between lines
+    for line in process.stdout:
+        match = _PCT_RE.search(line)
         if match:
             percent = int(match.group(1))
             # Send progress updates below 100%
@@ -109,6 +178,7 @@ def create_archive(input_files: list, output_dir: Path, archive_name: str,
                 if progress_callback:
                     action = "Encrypting" if password else "Archiving"
                     progress_callback(f"{action}: 100% complete")
+    process.wait()
     
     # If process completed but we never sent 100%, send it now
     if process.returncode == 0 and not sent_completion and progress_callback:
@@ -116,6 +186,7 @@ def create_archive(input_files: list, output_dir: Path, archive_name: str,
         progress_callback(f"{action}: 100% complete")
     
     if process.returncode != 0:
+        _print_7z_errors(process, reader, error_output)
         return None if not split_size_mb else []
     
     # Return path or list of parts
@@ -130,27 +201,30 @@ def decrypt_and_extract(archive_path: Path, output_dir: Path, password: str, pro
     """Extract encrypted archive"""
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    cmd = ["7z", "x", f"-p{password}", "-bsp1", "-y", f"-o{output_dir}", str(archive_path)]
+    cmd = ["7z", "x", f"-p{password}", f"-mmt={os.cpu_count() or 4}", "-bsp1", "-y", f"-o{output_dir}", str(archive_path)]
     
     process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    error_output = []
+    reader = _drain(process.stderr, error_output)
     
     last_percent = -1
-    while True:
-        line = process.stdout.readline()
-        if not line and process.poll() is not None:
-            break
-        match = re.search(r'(\d+)%', line)
+    for line in process.stdout:
+        match = _PCT_RE.search(line)
         if match:
             percent = int(match.group(1))
             if percent != last_percent:
                 last_percent = percent
                 if progress_callback:
                     progress_callback(f"Decrypting: {percent}% complete")
+    process.wait()
     
     if progress_callback:
         progress_callback(f"Decrypting: 100% complete")
     
-    return process.returncode == 0
+    if process.returncode != 0:
+        _print_7z_errors(process, reader, error_output)
+        return False
+    return True
 
 
 # Legacy function names for compatibility
@@ -160,11 +234,11 @@ def encrypt_multiple_files(input_files, output_dir, password, archive_name="arch
                          split_size_mb=None, progress_callback=progress_callback)
 
 
-def split_and_encrypt_multiple(input_files, output_dir, password, archive_name="archive", progress_callback=None):
+def split_and_encrypt_multiple(input_files, output_dir, password, archive_name="archive", progress_callback=None, sizes=None):
     """Legacy: Encrypt and split multiple files"""
     split_size_mb = config.get('split_size_mb', 2000)
     return create_archive(input_files, output_dir, archive_name, password=password,
-                         split_size_mb=split_size_mb, progress_callback=progress_callback)
+                         split_size_mb=split_size_mb, progress_callback=progress_callback, sizes=sizes)
 
 
 def archive_multiple_files_no_password(input_files, output_dir, archive_name="archive", progress_callback=None):
@@ -173,10 +247,10 @@ def archive_multiple_files_no_password(input_files, output_dir, archive_name="ar
                          split_size_mb=None, progress_callback=progress_callback)
 
 
-def split_archive_no_password(input_files, output_dir, archive_name, split_size_mb, progress_callback=None):
+def split_archive_no_password(input_files, output_dir, archive_name, split_size_mb, progress_callback=None, sizes=None):
     """Legacy: Archive and split without password"""
     return create_archive(input_files, output_dir, archive_name, password=None,
-                         split_size_mb=split_size_mb, progress_callback=progress_callback)
+                         split_size_mb=split_size_mb, progress_callback=progress_callback, sizes=sizes)
 
 
 def encrypt_file(input_file, output_dir, password, progress_callback=None):
@@ -185,10 +259,11 @@ def encrypt_file(input_file, output_dir, password, progress_callback=None):
                          split_size_mb=None, progress_callback=progress_callback)
 
 
-def encrypt_and_split_file(input_file, output_dir, password, split_size_mb, progress_callback=None):
+def encrypt_and_split_file(input_file, output_dir, password, split_size_mb, progress_callback=None, size=None):
     """Legacy: Encrypt and split single file"""
     return create_archive([input_file], output_dir, input_file.stem, password=password,
-                         split_size_mb=split_size_mb, progress_callback=progress_callback)
+                         split_size_mb=split_size_mb, progress_callback=progress_callback,
+                         sizes=None if size is None else [size])
 
 
 def archive_file_no_password(input_file, output_dir, progress_callback=None):
@@ -197,7 +272,8 @@ def archive_file_no_password(input_file, output_dir, progress_callback=None):
                          split_size_mb=None, progress_callback=progress_callback)
 
 
-def archive_and_split_file_no_password(input_file, output_dir, split_size_mb, progress_callback=None):
+def archive_and_split_file_no_password(input_file, output_dir, split_size_mb, progress_callback=None, size=None):
     """Legacy: Archive and split single file without password"""
     return create_archive([input_file], output_dir, input_file.stem, password=None,
-                         split_size_mb=split_size_mb, progress_callback=progress_callback)
+                         split_size_mb=split_size_mb, progress_callback=progress_callback,
+                         sizes=None if size is None else [size])
@@ -1,9 +1,11 @@
 """Fast parallel upload for Telegram using multiple connections"""
 import asyncio
+import functools
 import hashlib
 import math
 import os
-from typing import Optional, Tuple, BinaryIO
+from collections import deque
+from typing import Optional, Tuple
 
 from telethon import utils, helpers, TelegramClient
 from telethon.crypto import AuthKey
@@ -13,6 +15,24 @@ from telethon.tl.functions import InvokeWithLayerRequest
 from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
 from telethon.tl.functions.upload import SaveFilePartRequest, SaveBigFilePartRequest, GetFileRequest
 from telethon.tl.types import InputFileBig, InputFile, TypeInputFile, Document, InputDocumentFileLocation
+from telethon.crypto import aes as telethon_aes
+
+# Every part is AES-IGE encrypted; without cryptg (AES-NI) or libssl Telethon does it in pure Python
+if telethon_aes.cryptg is None and not telethon_aes.libssl.encrypt_ige:
+    print("[!] cryptg not installed, Telegram transfers will be CPU-bound (pip install cryptg)")
+
+
+PART_SIZE_KB = 512  # Largest part Telegram accepts; fewer, bigger parts mean fewer round trips
+
+
+@functools.lru_cache(maxsize=32)
+def part_plan(file_size: int, part_size_kb: Optional[float] = None) -> Tuple[int, int]:
+    """Return (part size in bytes, part count) for a transfer of file_size bytes"""
+    part_size = int((part_size_kb or PART_SIZE_KB) * 1024)
+    return part_size, (file_size + part_size - 1) // part_size
+
+
+DOWNLOAD_DEPTH = 4  # GetFileRequests kept in flight per download connection
 
 
 class DownloadSender:
@@ -22,19 +42,29 @@ class DownloadSender:
                  limit: int, stride: int, count: int):
         self.client = client
         self.sender = sender
-        self.request = GetFileRequest(file, offset=offset, limit=limit)
+        self.file = file
+        self.offset = offset
+        self.limit = limit
         self.stride = stride
         self.remaining = count
+        self.pending = deque()
     
     async def next(self) -> Optional[bytes]:
-        if not self.remaining:
+        # Keep a few requests queued on the connection so its round trips overlap
+        while self.remaining and len(self.pending) < DOWNLOAD_DEPTH:
+            request = GetFileRequest(self.file, offset=self.offset, limit=self.limit)
+            self.pending.append(asyncio.ensure_future(self.client._call(self.sender, request)))
+            self.offset += self.stride
+            self.remaining -= 1
+        if not self.pending:
             return None
-        result = await self.client._call(self.sender, self.request)
-        self.remaining -= 1
-        self.request.offset += self.stride
+        result = await self.pending.popleft()
         return result.bytes
     
     def disconnect(self):
+        for task in self.pending:
+            task.cancel()
+        self.pending.clear()
         return self.sender.disconnect()
 
 
@@ -65,9 +95,11 @@ class UploadSender:
         self.request.file_part += self.stride
     
     async def disconnect(self):
-        if self.previous:
-            await self.previous
-        return await self.sender.disconnect()
+        try:
+            if self.previous:
+                await self.previous
+        finally:
+            await self.sender.disconnect()
 
 
 class ParallelTransferrer:
@@ -87,6 +119,7 @@ class ParallelTransferrer:
         self.senders = None
     
     @staticmethod
+    @functools.lru_cache(maxsize=32)
     def _get_connection_count(file_size: int, max_count: int = 20, 
                              full_size: int = 100 * 1024 * 1024) -> int:
         """Calculate optimal number of connections based on file size"""
@@ -158,8 +191,7 @@ class ParallelTransferrer:
                          part_size_kb: Optional[float] = None,
                          connection_count: Optional[int] = None) -> Tuple[int, int, bool]:
         connection_count = connection_count or self._get_connection_count(file_size)
-        part_size = (part_size_kb or utils.get_appropriated_part_size(file_size)) * 1024
-        part_count = (file_size + part_size - 1) // part_size
+        part_size, part_count = part_plan(file_size, part_size_kb)
         is_large = file_size > 10 * 1024 * 1024
         await self._init_upload(connection_count, file_id, part_count, is_large)
         return part_size, part_count, is_large
@@ -171,37 +203,63 @@ class ParallelTransferrer:
     async def finish_upload(self):
         await self._cleanup()
     
+    async def abort_upload(self):
+        """Drop the parts still being sent and close every connection"""
+        for sender in self.senders:
+            if sender.previous:
+                sender.previous.cancel()
+        await asyncio.gather(*[sender.disconnect() for sender in self.senders], return_exceptions=True)
+        self.senders = None
+    
     async def download(self, file, file_size: int, part_size_kb: Optional[float] = None,
                       connection_count: Optional[int] = None):
         """Download file using parallel connections"""
         connection_count = connection_count or self._get_connection_count(file_size)
-        part_size = (part_size_kb or utils.get_appropriated_part_size(file_size)) * 1024
-        part_count = math.ceil(file_size / part_size)
+        part_size, part_count = part_plan(file_size, part_size_kb)
         
-        await self._init_download(connection_count, file, part_count, part_size)
-        
-        part = 0
-        while part < part_count:
-            tasks = []
-            for sender in self.senders:
-                tasks.append(self.loop.create_task(sender.next()))
-            for task in tasks:
-                data = await task
-                if not data:
-                    break
-                yield data
-                part += 1
-        
-        await self._cleanup()
+        try:
+            await self._init_download(connection_count, file, part_count, part_size)
+            
+            part = 0
+            while part < part_count:
+                tasks = []
+                for sender in self.senders:
+                    tasks.append(self.loop.create_task(sender.next()))
+                try:
+                    for task in tasks:
+                        data = await task
+                        if not data:
+                            break
+                        yield data
+                        part += 1
+                finally:
+                    for task in tasks:
+                        task.cancel()
+        finally:
+            # Runs on cancel and errors too, so no connection or queued request outlives the download
+            if self.senders is not None:
+                await self._cleanup()
 
 
-def stream_file(file_to_stream: BinaryIO, chunk_size=1024):
-    """Stream file in chunks"""
-    while True:
-        data_read = file_to_stream.read(chunk_size)
-        if not data_read:
-            break
-        yield data_read
+def read_part(f, size: int, hasher=None) -> bytes:
+    """Read size bytes from an unbuffered file, retrying short reads; less only at EOF
+    
+    If a hasher is given it is fed the part here, so hashing runs in the same worker thread as the read.
+    """
+    data = f.read(size)
+    if len(data) != size and data:
+        chunks = [data]
+        remaining = size - len(data)
+        while remaining:
+            more = f.read(remaining)
+            if not more:
+                break
+            chunks.append(more)
+            remaining -= len(more)
+        data = b"".join(chunks)
+    if hasher is not None:
+        hasher.update(data)
+    return data
 
 
 async def parallel_upload_file(client: TelegramClient, file_path: str, 
@@ -210,37 +268,44 @@ async def parallel_upload_file(client: TelegramClient, file_path: str,
     file_id = helpers.generate_random_long()
     file_size = os.path.getsize(file_path)
     
-    hash_md5 = hashlib.md5()
     uploader = ParallelTransferrer(client)
-    part_size, part_count, is_large = await uploader.init_upload(file_id, file_size, connection_count=max_connections)
-    
-    buffer = bytearray()
-    with open(file_path, 'rb') as f:
-        for data in stream_file(f, part_size):
-            if progress_callback:
-                progress_callback(f.tell(), file_size)
-            
-            if not is_large:
-                hash_md5.update(data)
-            
-            if len(buffer) == 0 and len(data) == part_size:
-                await uploader.upload(data)
-                continue
+    try:
+        part_size, part_count, is_large = await uploader.init_upload(file_id, file_size, connection_count=max_connections)
+        # Telegram only takes an MD5 for small files; big ones skip hashing entirely
+        hash_md5 = None if is_large else hashlib.md5()
+        
+        # Unbuffered, so each part is read straight into its own bytes object
+        # instead of being staged through BufferedReader's buffer first
+        with open(file_path, 'rb', buffering=0) as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
             
-            new_len = len(buffer) + len(data)
-            if new_len >= part_size:
-                cutoff = part_size - len(buffer)
-                buffer.extend(data[:cutoff])
-                await uploader.upload(bytes(buffer))
-                buffer.clear()
-                buffer.extend(data[cutoff:])
-            else:
-                buffer.extend(data)
+            # Read whole parts in a worker thread, one part ahead of the senders,
+            # so disk reads overlap the network and never block the event loop
+            pending = asyncio.ensure_future(asyncio.to_thread(read_part, f, part_size, hash_md5))
+            try:
+                sent = 0
+                for index in range(part_count):
+                    data = await pending
+                    pending = None
+                    if index + 1 < part_count:
+                        pending = asyncio.ensure_future(asyncio.to_thread(read_part, f, part_size, hash_md5))
+                    
+                    sent += len(data)
+                    if progress_callback:
+                        progress_callback(sent, file_size)
+                    
+                    await uploader.upload(data)
+            finally:
+                # Don't close the file under a read that is still running
+                if pending is not None:
+                    await asyncio.gather(pending, return_exceptions=True)
         
-        if len(buffer) > 0:
-            await uploader.upload(bytes(buffer))
-    
-    await uploader.finish_upload()
+        await uploader.finish_upload()
+    finally:
+        # Cancelled or failed before finish_upload: close the connections it would have
+        if uploader.senders is not None:
+            await uploader.abort_upload()
     
     if is_large:
         return InputFileBig(file_id, part_count, os.path.basename(file_path)), file_size
@@ -250,7 +315,7 @@ async def parallel_upload_file(client: TelegramClient, file_path: str,
 
 
 async def parallel_download_file(client: TelegramClient, message, output_path: str,
-                                 progress_callback=None):
+                                 progress_callback=None, max_connections: int = 20):
     """Download file using parallel connections for maximum speed"""
     file_size = message.file.size
     
@@ -259,8 +324,27 @@ async def parallel_download_file(client: TelegramClient, message, output_path: s
     
     downloader = ParallelTransferrer(client, dc_id)
     
+    received = 0
+    connection_count = downloader._get_connection_count(file_size, max_connections)
+    chunks = downloader.download(location, file_size, connection_count=connection_count)
     with open(output_path, 'wb') as f:
-        async for chunk in downloader.download(location, file_size):
-            f.write(chunk)
-            if progress_callback:
-                progress_callback(f.tell(), file_size)
+        # Write each chunk in a worker thread while the next one downloads,
+        # so a slow disk doesn't stall the event loop; one write in flight keeps order
+        pending = None
+        try:
+            async for chunk in chunks:
+                if pending is not None:
+                    await pending
+                pending = asyncio.ensure_future(asyncio.to_thread(f.write, chunk))
+                received += len(chunk)  # Counted here rather than f.tell(), which seeks on every chunk
+                if progress_callback:
+                    progress_callback(received, file_size)
+            if pending is not None:
+                await pending
+                pending = None
+        finally:
+            # Close the generator right away so its connections are released on cancel or error
+            await chunks.aclose()
+            # Don't close the file under a write that is still running
+            if pending is not None:
+                await asyncio.gather(pending, return_exceptions=True)
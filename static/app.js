@@ -18,40 +18,66 @@ function showTab(tabName) {
     }
 }
 
-// Progress logging with polling
+// Progress logging - streamed with server-sent events, polling as fallback
 let progressPollInterval = null;
+let progressEventSource = null;
 let currentJobId = null;
 
+function handleProgressUpdate(data, state) {
+    // Load historical logs on first update (for page refresh)
+    if (!state.logsLoaded && data.logs && data.logs.length > 0) {
+        state.logsLoaded = true;
+        data.logs.forEach(log => {
+            logProgress(log.msg, log.type);
+        });
+    }
+    
+    // Don't log "COMPLETE" messages - they're just status markers
+    if (data.message && data.message !== 'COMPLETE') {
+        logProgress(data.message);
+    }
+    if (data.complete) {
+        console.log('[POLLING] Job complete, results:', data.results);
+        stopProgressPolling();
+        if (data.results && data.results.length > 0) {
+            console.log('[POLLING] Setting window.compressionResults:', data.results);
+            window.compressionResults = data.results;
+        }
+    }
+}
+
 function startProgressPolling(jobId) {
     currentJobId = jobId;
     stopProgressPolling();
     
-    let logsLoaded = false;
+    const state = {logsLoaded: false};
+    
+    if (window.EventSource) {
+        progressEventSource = new EventSource(`/progress-stream/${jobId}`);
+        progressEventSource.onmessage = (e) => handleProgressUpdate(JSON.parse(e.data), state);
+        progressEventSource.onerror = () => {
+            // Stream dropped - fall back to polling
+            if (progressEventSource && currentJobId === jobId) {
+                progressEventSource.close();
+                progressEventSource = null;
+                pollProgress(jobId, state);
+            }
+        };
+        return;
+    }
     
+    pollProgress(jobId, state);
+}
+
+function pollProgress(jobId, state) {
     progressPollInterval = setInterval(() => {
-        fetch(`/progress/${jobId}`)
+        // After the first poll only ask for log entries we haven't seen
+        const since = state.logSeq !== undefined ? `?since=${state.logSeq}` : '';
+        fetch(`/progress/${jobId}${since}`)
         .then(r => r.json())
         .then(data => {
-            // Load historical logs on first poll (for page refresh)
-            if (!logsLoaded && data.logs && data.logs.length > 0) {
-                logsLoaded = true;
-                data.logs.forEach(log => {
-                    logProgress(log.msg, log.type);
-                });
-            }
-            
-            // Don't log "COMPLETE" messages - they're just status markers
-            if (data.message && data.message !== 'COMPLETE') {
-                logProgress(data.message);
-            }
-            if (data.complete) {
-                console.log('[POLLING] Job complete, results:', data.results);
-                stopProgressPolling();
-                if (data.results && data.results.length > 0) {
-                    console.log('[POLLING] Setting window.compressionResults:', data.results);
-                    window.compressionResults = data.results;
-                }
-            }
+            state.logSeq = data.seq;
+            handleProgressUpdate(data, state);
         })
         .catch(err => {
             // Silent fail - polling will retry
@@ -60,6 +86,10 @@ function startProgressPolling(jobId) {
 }
 
 function stopProgressPolling() {
+    if (progressEventSource) {
+        progressEventSource.close();
+        progressEventSource = null;
+    }
     if (progressPollInterval) {
         clearInterval(progressPollInterval);
         progressPollInterval = null;
@@ -722,10 +752,14 @@ function deleteTelegramArchive(archiveId) {
     clearProgress();
     logProgress(`Deleting archive: ${archiveId}...`);
     
+    // Send the part ids we already listed so the server doesn't search the chat again
+    const archive = currentArchives.find(a => a.id === archiveId);
+    const messageIds = archive ? archive.files.map(f => f.message_id) : null;
+    
     fetch('/telegram-delete', {
         method: 'POST',
         headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({archive_id: archiveId})
+        body: JSON.stringify({archive_id: archiveId, message_ids: messageIds})
     })
     .then(r => r.json())
     .then(data => {
@@ -982,6 +1016,7 @@ function saveSettings() {
         video_keep_audio: document.getElementById('video_keep_audio').value === 'true',
         cpu_preset: document.getElementById('cpu_preset').value,
         cpu_threads: parseInt(document.getElementById('cpu_threads').value) || 0,
+        video_encoder: document.getElementById('video_encoder').value,
         parallel_connections: parseInt(document.getElementById('parallel_connections').value) || 20
     };
     
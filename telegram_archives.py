@@ -1,82 +1,70 @@
 """Telegram archive management - fetch, download, delete"""
 import os
 import asyncio
+import re
+from collections import defaultdict
+from operator import itemgetter
 from pathlib import Path
 
-async def fetch_telegram_archives(api_id: str, api_hash: str, destination: str, workspace_dir: Path):
+from telethon.tl.types import InputMessagesFilterDocument
+
+from parallel_upload import parallel_download_file
+from config import config
+from telegram_client import get_shared_client, resolve_destination
+
+DOWNLOAD_CONCURRENCY = 3  # Parts of one archive downloaded at once
+
+# Matches archive.7z and split parts archive.7z.001, capturing name and part number
+_ARCHIVE_NAME_RE = re.compile(r'(.+?)\.7z(?:\.(\d+))?$')
+
+def is_archive_file(name, archive_id):
+    """True if name is archive_id.7z or one of its archive_id.7z.NNN parts"""
+    base = archive_id + '.7z'
+    if not name.startswith(base):
+        return False
+    rest = name[len(base):]
+    return not rest or (rest[0] == '.' and rest[1:].isdigit())
+
+async def fetch_telegram_archives(destination: str):
     """Fetch and group archives from Telegram"""
-    from telethon import TelegramClient
-    from datetime import datetime
-    import re
-    
-    session_file = workspace_dir.parent / "dailyarchive_session"
-    client = TelegramClient(str(session_file), int(api_id), api_hash, sequential_updates=True)
     
-    await client.connect()
-    if not await client.is_user_authorized():
-        await client.start()
+    client = await get_shared_client()
+    dest = await resolve_destination(client, destination)
     
-    # Convert destination
-    dest = destination
-    if dest != "me" and dest.lstrip('-').isdigit():
-        dest = int(dest)
+    # Group documents by archive name as they arrive (detect .7z and .7z.001, .7z.002 pattern);
+    # sizes stay in bytes until the output pass
+    archives = defaultdict(lambda: {'files': [], 'total_size': 0, 'date': None})
     
-    # Fetch messages with documents
-    messages = []
-    async for message in client.iter_messages(dest, limit=1000):
-        if message.document and message.file.name:
-            messages.append(message)
-    
-    await client.disconnect()
-    
-    # Group by archive name (detect .7z and .7z.001, .7z.002 pattern)
-    archives = {}
-    
-    for msg in messages:
+    async for msg in client.iter_messages(dest, limit=1000, filter=InputMessagesFilterDocument):
+        if not msg.document:
+            continue
         filename = msg.file.name
+        match = _ARCHIVE_NAME_RE.match(filename) if filename else None
+        if not match:
+            continue
         
-        # Detect archive pattern
-        match = re.match(r'(.+?)\.7z(?:\.(\d+))?$', filename)
-        if match:
-            archive_name = match.group(1)
-            part_num = int(match.group(2)) if match.group(2) else 0
-            
-            if archive_name not in archives:
-                archives[archive_name] = {
-                    'id': archive_name,
-                    'name': archive_name,
-                    'files': [],
-                    'parts': 0,
-                    'total_size': 0,
-                    'date': None,
-                    'expanded': False
-                }
-            
-            archives[archive_name]['files'].append({
-                'name': filename,
-                'size': f"{msg.file.size / (1024*1024):.1f} MB",
-                'message_id': msg.id,
-                'part_num': part_num
-            })
-            archives[archive_name]['parts'] += 1
-            archives[archive_name]['total_size'] += msg.file.size
-            
-            if not archives[archive_name]['date'] or msg.date > archives[archive_name]['date']:
-                archives[archive_name]['date'] = msg.date
+        archive_name, part = match.groups()
+        size = msg.file.size
+        archive = archives[archive_name]
+        archive['files'].append((int(part) if part else 0, filename, size, msg.id))
+        archive['total_size'] += size
+        if archive['date'] is None or msg.date > archive['date']:
+            archive['date'] = msg.date
     
     # Format output
     result = []
-    for archive in archives.values():
+    for archive_name, archive in archives.items():
         # Sort files by part number
-        archive['files'].sort(key=lambda x: x['part_num'])
+        files = sorted(archive['files'], key=itemgetter(0))
         
         result.append({
-            'id': archive['id'],
-            'name': archive['name'],
-            'parts': archive['parts'],
+            'id': archive_name,
+            'name': archive_name,
+            'parts': len(files),
             'total_size': f"{archive['total_size'] / (1024*1024):.1f} MB",
             'date': archive['date'].strftime('%Y-%m-%d %H:%M') if archive['date'] else 'Unknown',
-            'files': archive['files'],
+            'files': [{'name': name, 'size': f"{size / (1024*1024):.1f} MB", 'message_id': message_id, 'part_num': part_num}
+                      for part_num, name, size, message_id in files],
             'expanded': False
         })
     
@@ -85,74 +73,74 @@ async def fetch_telegram_archives(api_id: str, api_hash: str, destination: str,
     
     return result
 
-async def download_telegram_archive(archive_id: str, api_id: str, api_hash: str, destination: str, workspace_dir: Path):
-    """Download archive from Telegram"""
-    from telethon import TelegramClient
-    import re
-    
-    session_file = workspace_dir.parent / "dailyarchive_session"
-    client = TelegramClient(str(session_file), int(api_id), api_hash, sequential_updates=True)
+async def download_telegram_archive(archive_id: str, destination: str, workspace_dir: Path, message_ids: list = None):
+    """Download archive from Telegram
     
-    await client.connect()
-    if not await client.is_user_authorized():
-        await client.start()
+    message_ids can be the part ids already returned by fetch_telegram_archives, to skip searching the chat again.
+    """
     
-    # Convert destination
-    dest = destination
-    if dest != "me" and dest.lstrip('-').isdigit():
-        dest = int(dest)
+    client = await get_shared_client()
+    dest = await resolve_destination(client, destination)
     
     # Create download folder
     download_dir = workspace_dir / f"downloaded_{archive_id}"
     download_dir.mkdir(exist_ok=True)
     
-    # Fetch and download matching files
-    async for message in client.iter_messages(dest, limit=1000):
-        if message.document and message.file.name:
+    if message_ids:
+        messages = [m for m in await client.get_messages(dest, ids=message_ids) if m is not None]
+    else:
+        messages = [m async for m in client.iter_messages(dest, limit=1000, search=archive_id, filter=InputMessagesFilterDocument)]
+    
+    # The archive id is known, so a prefix check replaces the regex
+    matches = [m for m in messages if m.document and m.file.name and is_archive_file(m.file.name, archive_id)]
+    
+    # Split the connection budget between concurrent parts so the socket count stays the same
+    max_connections = max(1, config.get('parallel_connections', 20) // DOWNLOAD_CONCURRENCY)
+    sem = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+    
+    async def download_one(message):
+        async with sem:
             filename = message.file.name
-            match = re.match(r'(.+?)\.7z(?:\.(\d+))?$', filename)
-            
-            if match and match.group(1) == archive_id:
-                print(f"Downloading {filename}...")
-                await message.download_media(file=str(download_dir / filename))
+            print(f"Downloading {filename}...")
+            # Parallel connections, with chunks written by a worker thread rather than on the loop
+            await parallel_download_file(client, message, str(download_dir / filename),
+                                         max_connections=max_connections)
     
-    await client.disconnect()
+    await asyncio.gather(*(download_one(m) for m in matches))
     
     return download_dir
 
-async def delete_telegram_archive(archive_id: str, api_id: str, api_hash: str, destination: str, workspace_dir: Path):
-    """Delete archive from Telegram"""
-    from telethon import TelegramClient
-    import re
+async def delete_telegram_archive(archive_id: str, destination: str, message_ids: list = None):
+    """Delete archive from Telegram
     
-    session_file = workspace_dir.parent / "dailyarchive_session"
-    client = TelegramClient(str(session_file), int(api_id), api_hash, sequential_updates=True)
+    message_ids can be the part ids already returned by fetch_telegram_archives; they are
+    fetched in one request and still checked against archive_id before anything is deleted.
+    """
     
-    await client.connect()
-    if not await client.is_user_authorized():
-        await client.start()
+    client = await get_shared_client()
+    dest = await resolve_destination(client, destination)
     
-    # Convert destination
-    dest = destination
-    if dest != "me" and dest.lstrip('-').isdigit():
-        dest = int(dest)
+    if message_ids:
+        messages = [m for m in await client.get_messages(dest, ids=message_ids) if m is not None]
+    else:
+        # The server-side search only returns documents mentioning the archive id
+        messages = [m async for m in client.iter_messages(dest, limit=1000, search=archive_id, filter=InputMessagesFilterDocument)]
     
-    # Find and delete matching messages
+    # Collect and delete matching messages
     deleted = 0
     message_ids = []
     
-    async for message in client.iter_messages(dest, limit=1000):
+    for message in messages:
         if message.document and message.file.name:
             filename = message.file.name
-            match = re.match(r'(.+?)\.7z(?:\.(\d+))?$', filename)
             
-            if match and match.group(1) == archive_id:
+            # The archive id is known, so a prefix check replaces the regex
+            if is_archive_file(filename, archive_id):
                 message_ids.append(message.id)
     
     if message_ids:
+        # One call for all parts; Telethon packs the ids 100 per DeleteMessagesRequest
         await client.delete_messages(dest, message_ids)
         deleted = len(message_ids)
     
-    await client.disconnect()
-    
     return deleted
@@ -0,0 +1,108 @@
+"""Shared Telegram client on a long-lived background event loop"""
+import asyncio
+import atexit
+import multiprocessing
+import threading
+
+from telethon import TelegramClient
+from telethon.sessions import SQLiteSession
+
+from config import config, WORKSPACE_DIR
+
+try:
+    import uvloop  # Optional, faster event loop on Linux/macOS
+except ImportError:
+    uvloop = None
+
+SESSION_FILE = WORKSPACE_DIR.parent / "dailyarchive_session"
+
+# One loop runs forever in a daemon thread; every Telegram coroutine is scheduled on it.
+# Spawned worker processes import this too, but never talk to Telegram, so they don't start it
+loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+if multiprocessing.parent_process() is None:
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+_client = None
+_client_lock = None  # asyncio.Lock, created on the loop
+_peers = {}  # Configured destination string -> resolved input peer
+
+class WALSession(SQLiteSession):
+    """SQLite session in WAL mode, so saves skip the full fsync and readers don't block the writer"""
+    
+    def _cursor(self):
+        if self._conn is None:
+            cursor = super()._cursor()
+            cursor.execute('pragma journal_mode=wal')
+            cursor.execute('pragma synchronous=normal')
+            cursor.execute('pragma temp_store=memory')
+            return cursor
+        return super()._cursor()
+
+def create_telegram_client(api_id, api_hash):
+    """Create TelegramClient with persistent session"""
+    return TelegramClient(
+        WALSession(str(SESSION_FILE)),
+        int(api_id),
+        api_hash,
+        sequential_updates=True
+    )
+
+async def get_client():
+    """Return the shared client, connected on first use but not necessarily logged in"""
+    global _client, _client_lock
+    if _client_lock is None:
+        _client_lock = asyncio.Lock()
+    async with _client_lock:
+        if _client is None:
+            _client = create_telegram_client(config['telegram_api_id'], config['telegram_api_hash'])
+        if not _client.is_connected():
+            await _client.connect()
+        return _client
+
+async def get_shared_client():
+    """Return the shared client, raising if the saved session isn't authorized
+    
+    Never calls client.start(): its interactive prompts would block the shared loop.
+    """
+    client = await get_client()
+    if not await client.is_user_authorized():
+        raise Exception('Not logged in to Telegram. Please login from Settings first.')
+    return client
+
+async def resolve_destination(client, destination):
+    """Resolve a destination ('me', a channel id or a username) to an input peer, once per client"""
+    peer = _peers.get(destination)
+    if peer is None:
+        dest = destination
+        if dest != "me" and dest.lstrip('-').isdigit():
+            dest = int(dest)
+        peer = await client.get_input_entity(dest)
+        _peers[destination] = peer
+    return peer
+
+def submit_telegram(coro):
+    """Schedule a coroutine on the Telegram loop and return a concurrent Future"""
+    return asyncio.run_coroutine_threadsafe(coro, loop)
+
+def run_async(coro, timeout=None):
+    """Run a coroutine on the Telegram loop and block until it finishes"""
+    return submit_telegram(coro).result(timeout)
+
+def reset_client():
+    """Drop the shared client so the next call reconnects with current credentials"""
+    global _client
+    client, _client = _client, None
+    _peers.clear()  # Peers are only valid for the account they were resolved with
+    if client is not None:
+        try:
+            submit_telegram(client.disconnect()).result(timeout=10)
+        except Exception:
+            pass
+
+def delete_session():
+    """Log out locally: drop the shared client and remove the session database"""
+    reset_client()
+    for suffix in ('.session', '.session-wal', '.session-shm', '.session-journal'):
+        SESSION_FILE.with_name(SESSION_FILE.name + suffix).unlink(missing_ok=True)
+
+atexit.register(reset_client)
@@ -2,103 +2,146 @@
 import os
 import asyncio
 import hashlib
-import math
-from pathlib import Path
+import time
+from datetime import datetime
+
+from telethon import helpers
+from telethon.tl.functions.messages import SendMediaRequest
+from telethon.tl.functions.upload import SaveFilePartRequest, SaveBigFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig, InputMediaUploadedDocument, DocumentAttributeFilename, Channel
+
+from config import config
+from encryption import cached_list_archive_contents, format_size
+from parallel_upload import part_plan, read_part
+from telegram_client import get_shared_client, resolve_destination
+
+UPLOAD_PARTS_IN_FLIGHT = 4  # SaveFilePart requests outstanding at once on the client
 
 async def fast_upload_file(client, file_path, progress_callback=None):
     """Upload file using optimized method"""
-    from telethon import utils, helpers
-    from telethon.tl.types import InputFile, InputFileBig
-    from telethon.tl.functions.upload import SaveFilePartRequest, SaveBigFilePartRequest
     
     file_id = helpers.generate_random_long()
     file_size = os.path.getsize(file_path)
     
     # Determine part size and count
-    part_size = utils.get_appropriated_part_size(file_size) * 1024
-    part_count = math.ceil(file_size / part_size)
+    part_size, part_count = part_plan(file_size)
     is_large = file_size > 10 * 1024 * 1024
     
-    hash_md5 = hashlib.md5()
+    # Only small files carry an MD5; it is fed in part order by the reader
+    hash_md5 = None if is_large else hashlib.md5()
+    slots = asyncio.Semaphore(UPLOAD_PARTS_IN_FLIGHT)
+    sent = 0
     
-    with open(file_path, 'rb') as f:
-        for part_index in range(part_count):
-            part = f.read(part_size)
-            
-            if not is_large:
-                hash_md5.update(part)
-            
-            # Upload part
+    async def send_part(part_index, part):
+        nonlocal sent
+        try:
             if is_large:
                 await client(SaveBigFilePartRequest(file_id, part_index, part_count, part))
             else:
                 await client(SaveFilePartRequest(file_id, part_index, part))
-            
-            if progress_callback:
-                progress_callback(f.tell(), file_size)
+        finally:
+            slots.release()
+        sent += len(part)
+        if progress_callback:
+            progress_callback(sent, file_size)
+    
+    failed = []  # Exceptions from finished sends, checked before each new part goes out
+    
+    def part_done(task):
+        if not task.cancelled() and task.exception() is not None:
+            failed.append(task.exception())
+    
+    # Parts are read in a worker thread and sent while the next ones are read and sent;
+    # the next read starts before waiting for a free slot, so the disk never waits on the network
+    sends = []
+    try:
+        with open(file_path, 'rb', buffering=0) as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            pending = asyncio.ensure_future(asyncio.to_thread(read_part, f, part_size, hash_md5))
+            try:
+                for part_index in range(part_count):
+                    part = await pending
+                    pending = None
+                    if part_index + 1 < part_count:
+                        pending = asyncio.ensure_future(asyncio.to_thread(read_part, f, part_size, hash_md5))
+                    await slots.acquire()
+                    if failed:
+                        raise failed[0]  # Don't read and send the rest of a file that already failed
+                    task = asyncio.ensure_future(send_part(part_index, part))
+                    task.add_done_callback(part_done)
+                    sends.append(task)
+            finally:
+                # Don't close the file under a read that is still running
+                if pending is not None:
+                    await asyncio.gather(pending, return_exceptions=True)
+        await asyncio.gather(*sends)
+    except BaseException:
+        # Stop the parts still in flight and collect them, so none is left without an owner
+        for task in sends:
+            task.cancel()
+        await asyncio.gather(*sends, return_exceptions=True)
+        raise
     
     if is_large:
         return InputFileBig(file_id, part_count, os.path.basename(file_path))
     else:
         return InputFile(file_id, part_count, os.path.basename(file_path), hash_md5.hexdigest())
 
-async def upload_files_to_telegram(parts: list, destination: str, api_id: str, api_hash: str, workspace_dir: Path, archive_password: str = None):
-    """Upload files to Telegram"""
-    from telethon import TelegramClient, helpers
-    from telethon.tl.functions.messages import SendMediaRequest
-    from telethon.tl.types import InputMediaUploadedDocument, DocumentAttributeFilename
-    from datetime import datetime
-    from config import config
-    from encryption import list_archive_contents
-    
-    # Session file stays in root, not workspace
-    session_file = workspace_dir.parent / "dailyarchive_session"
-    client = TelegramClient(
-        str(session_file),
-        int(api_id),
-        api_hash,
-        sequential_updates=True
-    )
-    
-    # Performance tweaks and session persistence
-    client.flood_sleep_threshold = 0
+def print_progress(interval_ns=100_000_000):
+    """Build a progress callback that reprints the percentage at most every interval_ns"""
+    state = [0]  # Next deadline
+    
+    def callback(current, total):
+        now_ns = time.monotonic_ns()
+        if now_ns < state[0] and current != total:
+            return
+        state[0] = now_ns + interval_ns
+        print(f"\r    Progress: {current/total*100:.1f}%", end="", flush=True)
+    
+    return callback
+
+async def upload_files_to_telegram(parts: list, destination: str, archive_password: str = None):
+    """Upload files to Telegram over the shared client (run it on the Telegram loop)"""
     
-    await client.connect()
-    if not await client.is_user_authorized():
-        await client.start()
+    client = await get_shared_client()
     
     print("\n" + "-" * 78)
     print("    [+] UPLOADING (Fast Mode)")
     print("-" * 78)
     
-    # Convert destination to int if it's a channel ID
-    dest = destination
-    if dest != "me" and dest.lstrip('-').isdigit():
-        dest = int(dest)
+    dest = await resolve_destination(client, destination)
     
     for i, part in enumerate(parts, 1):
         print(f"\n    [{i}/{len(parts)}] Uploading {part.name}...")
         
+        caption_mode = config.get("upload_caption", "detailed")
+        
+        # Listing runs 7z, so start it in a worker thread now and let it overlap the upload
+        contents_task = None
+        if caption_mode not in ("none", "minimal") and archive_password and part.suffix in ['.7z', '.001']:
+            # For split archives, use the first part
+            archive_to_check = part if part.suffix == '.7z' else part.parent / f"{part.stem.rsplit('.', 1)[0]}.7z.001"
+            contents_task = asyncio.ensure_future(
+                asyncio.to_thread(cached_list_archive_contents, archive_to_check, archive_password))
+        
         # Use fast upload
         uploaded_file = await fast_upload_file(
             client,
             str(part),
-            progress_callback=lambda current, total: print(
-                f"\r    Progress: {current/total*100:.1f}%", end=""
-            )
+            progress_callback=print_progress()
         )
         
         # Generate caption based on settings
-        caption_mode = config.get("upload_caption", "detailed")
-        
         if caption_mode == "none":
             caption = ""
         elif caption_mode == "minimal":
             caption = f"📦 {part.name}"
         else:  # detailed
             # Get file info
-            file_size = part.stat().st_size / (1024 * 1024)  # MB
-            created_date = datetime.fromtimestamp(part.stat().st_ctime).strftime("%Y-%m-%d %H:%M")
+            st = part.stat()
+            file_size = st.st_size / (1024 * 1024)  # MB
+            created_date = datetime.fromtimestamp(st.st_ctime).strftime("%Y-%m-%d %H:%M")
             upload_date = datetime.now().strftime("%Y-%m-%d %H:%M")
             
             # Try to detect what's inside (from folder name or file name)
@@ -110,28 +153,16 @@ async def upload_files_to_telegram(parts: list, destination: str, api_id: str, a
             caption += f"📊 Size: {file_size:.1f} MB\n"
             
             # List archive contents if password provided
-            if archive_password and part.suffix in ['.7z', '.001']:
-                # For split archives, use the first part
-                archive_to_check = part if part.suffix == '.7z' else part.parent / f"{part.stem.rsplit('.', 1)[0]}.7z.001"
-                
-                contents = list_archive_contents(archive_to_check, archive_password)
+            if contents_task is not None:
+                try:
+                    contents = await contents_task
+                except Exception:
+                    contents = None
                 
                 if contents:
                     caption += f"\n📄 Contents ({len(contents)} file(s)):\n"
                     for file_info in contents[:10]:  # Limit to 10 files
-                        # Convert size to readable format
-                        try:
-                            size_bytes = int(file_info['size'])
-                            if size_bytes < 1024:
-                                size_str = f"{size_bytes} B"
-                            elif size_bytes < 1024 * 1024:
-                                size_str = f"{size_bytes / 1024:.1f} KB"
-                            else:
-                                size_str = f"{size_bytes / (1024 * 1024):.1f} MB"
-                        except:
-                            size_str = file_info['size']
-                        
-                        caption += f"  • {file_info['name']} ({size_str})\n"
+                        caption += f"  • {file_info['name']} ({format_size(file_info['size'])})\n"
                     
                     if len(contents) > 10:
                         caption += f"  ... and {len(contents) - 10} more\n"
@@ -153,26 +184,11 @@ async def upload_files_to_telegram(parts: list, destination: str, api_id: str, a
         ))
         
         print(f"\n    [+] Uploaded {part.name}")
-    
-    await client.disconnect()
 
-async def fetch_telegram_channels(api_id: str, api_hash: str, workspace_dir: Path):
-    """Fetch user's Telegram channels"""
-    from telethon import TelegramClient
-    from telethon.tl.types import Channel
-    
-    # Session file stays in root, not workspace
-    session_file = workspace_dir.parent / "dailyarchive_session"
-    client = TelegramClient(
-        str(session_file),
-        int(api_id),
-        api_hash,
-        sequential_updates=True
-    )
+async def fetch_telegram_channels():
+    """Fetch user's Telegram channels over the shared client (run it on the Telegram loop)"""
     
-    await client.connect()
-    if not await client.is_user_authorized():
-        await client.start()
+    client = await get_shared_client()
     
     dialogs = await client.get_dialogs()
     channels = []
@@ -187,160 +203,5 @@ async def fetch_telegram_channels(api_id: str, api_hash: str, workspace_dir: Pat
             print(f"        {idx}. {dialog.name} (ID: {dialog.entity.id})")
             idx += 1
     
-    await client.disconnect()
     return channels
 
-
-async def fetch_telegram_archives(api_id: str, api_hash: str, destination: str, workspace_dir: Path):
-    """Fetch and group archives from Telegram"""
-    from telethon import TelegramClient
-    from datetime import datetime
-    import re
-    
-    session_file = workspace_dir.parent / "dailyarchive_session"
-    client = TelegramClient(str(session_file), int(api_id), api_hash, sequential_updates=True)
-    
-    await client.connect()
-    if not await client.is_user_authorized():
-        await client.start()
-    
-    # Convert destination
-    dest = destination
-    if dest != "me" and dest.lstrip('-').isdigit():
-        dest = int(dest)
-    
-    # Fetch messages with documents
-    messages = []
-    async for message in client.iter_messages(dest, limit=1000):
-        if message.document and message.file.name:
-            messages.append(message)
-    
-    await client.disconnect()
-    
-    # Group by archive name (detect .7z and .7z.001, .7z.002 pattern)
-    archives = {}
-    
-    for msg in messages:
-        filename = msg.file.name
-        
-        # Detect archive pattern
-        match = re.match(r'(.+?)\.7z(?:\.(\d+))?$', filename)
-        if match:
-            archive_name = match.group(1)
-            part_num = int(match.group(2)) if match.group(2) else 0
-            
-            if archive_name not in archives:
-                archives[archive_name] = {
-                    'id': archive_name,
-                    'name': archive_name,
-                    'files': [],
-                    'parts': 0,
-                    'total_size': 0,
-                    'date': None,
-                    'expanded': False
-                }
-            
-            archives[archive_name]['files'].append({
-                'name': filename,
-                'size': f"{msg.file.size / (1024*1024):.1f} MB",
-                'message_id': msg.id,
-                'part_num': part_num
-            })
-            archives[archive_name]['parts'] += 1
-            archives[archive_name]['total_size'] += msg.file.size
-            
-            if not archives[archive_name]['date'] or msg.date > archives[archive_name]['date']:
-                archives[archive_name]['date'] = msg.date
-    
-    # Format output
-    result = []
-    for archive in archives.values():
-        # Sort files by part number
-        archive['files'].sort(key=lambda x: x['part_num'])
-        
-        result.append({
-            'id': archive['id'],
-            'name': archive['name'],
-            'parts': archive['parts'],
-            'total_size': f"{archive['total_size'] / (1024*1024):.1f} MB",
-            'date': archive['date'].strftime('%Y-%m-%d %H:%M') if archive['date'] else 'Unknown',
-            'files': archive['files'],
-            'expanded': False
-        })
-    
-    # Sort by date (newest first)
-    result.sort(key=lambda x: x['date'], reverse=True)
-    
-    return result
-
-async def download_telegram_archive(archive_id: str, api_id: str, api_hash: str, destination: str, workspace_dir: Path):
-    """Download archive from Telegram"""
-    from telethon import TelegramClient
-    import re
-    
-    session_file = workspace_dir.parent / "dailyarchive_session"
-    client = TelegramClient(str(session_file), int(api_id), api_hash, sequential_updates=True)
-    
-    await client.connect()
-    if not await client.is_user_authorized():
-        await client.start()
-    
-    # Convert destination
-    dest = destination
-    if dest != "me" and dest.lstrip('-').isdigit():
-        dest = int(dest)
-    
-    # Create download folder
-    download_dir = workspace_dir / f"downloaded_{archive_id}"
-    download_dir.mkdir(exist_ok=True)
-    
-    # Fetch and download matching files
-    async for message in client.iter_messages(dest, limit=1000):
-        if message.document and message.file.name:
-            filename = message.file.name
-            match = re.match(r'(.+?)\.7z(?:\.(\d+))?$', filename)
-            
-            if match and match.group(1) == archive_id:
-                print(f"Downloading {filename}...")
-                await message.download_media(file=str(download_dir / filename))
-    
-    await client.disconnect()
-    
-    return download_dir
-
-async def delete_telegram_archive(archive_id: str, api_id: str, api_hash: str, destination: str, workspace_dir: Path):
-    """Delete archive from Telegram"""
-    from telethon import TelegramClient
-    import re
-    
-    session_file = workspace_dir.parent / "dailyarchive_session"
-    client = TelegramClient(str(session_file), int(api_id), api_hash, sequential_updates=True)
-    
-    await client.connect()
-    if not await client.is_user_authorized():
-        await client.start()
-    
-    # Convert destination
-    dest = destination
-    if dest != "me" and dest.lstrip('-').isdigit():
-        dest = int(dest)
-    
-    # Find and delete matching messages
-    deleted = 0
-    message_ids = []
-    
-    async for message in client.iter_messages(dest, limit=1000):
-        if message.document and message.file.name:
-            filename = message.file.name
-            match = re.match(r'(.+?)\.7z(?:\.(\d+))?$', filename)
-            
-            if match and match.group(1) == archive_id:
-                message_ids.append(message.id)
-    
-    if message_ids:
-        await client.delete_messages(dest, message_ids)
-        deleted = len(message_ids)
-    
-    await client.disconnect()
-    
-    return deleted
@@ -1,7 +1,47 @@
 """Video compression functions"""
+import asyncio
+import functools
+import json
+import multiprocessing
 import subprocess
+import threading
 from pathlib import Path
-from config import FFMPEG_CRF
+from config import FFMPEG_CRF, get_ffmpeg_preset
+
+try:
+    import av  # Optional PyAV, reads container headers without spawning ffprobe
+except ImportError:
+    av = None
+
+# Hardware H.264 encoders in order of preference, with flags roughly matching libx264 at FFMPEG_CRF
+HW_ENCODERS = {
+    "h264_nvenc": ["-preset", "p5", "-rc", "vbr", "-cq", str(FFMPEG_CRF), "-b:v", "0"],
+    "h264_qsv": ["-global_quality", str(FFMPEG_CRF)],
+    "h264_videotoolbox": ["-q:v", "55"],
+    "h264_amf": ["-rc", "cqp", "-qp_i", str(FFMPEG_CRF), "-qp_p", str(FFMPEG_CRF)],
+}
+
+@functools.lru_cache(maxsize=1)
+def detect_hw_encoder():
+    """Return the first hardware H.264 encoder that can actually encode on this machine, or None"""
+    try:
+        listing = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True, timeout=10).stdout
+    except:
+        return None
+    for encoder in HW_ENCODERS:
+        if encoder not in listing:
+            continue
+        # Being built into ffmpeg doesn't mean the GPU/driver is there, so try a tiny encode
+        try:
+            test = subprocess.run(["ffmpeg", "-hide_banner", "-v", "error", "-f", "lavfi", "-i", "color=s=256x256:d=0.2",
+                                   "-c:v", encoder, "-f", "null", "-"], capture_output=True, timeout=30)
+        except:
+            continue
+        if test.returncode == 0:
+            return encoder
+    return None
+
+PROGRESS_PREFIX = b"out_time_ms="  # ffmpeg -progress key, in microseconds despite the name
 
 def get_file_size_gb(file_path: Path) -> float:
     """Get file size in GB"""
@@ -16,8 +56,54 @@ def get_video_duration(input_file: Path) -> float:
     except:
         return 0
 
+def _av_probe(path) -> dict:
+    """Read stream info with PyAV, shaped like the ffprobe JSON probe_videos returns"""
+    with av.open(str(path)) as container:
+        streams = []
+        for stream in container.streams:
+            info = {'codec_type': stream.type, 'codec_name': stream.codec_context.name}
+            if stream.type == 'video':
+                info['width'] = stream.codec_context.width
+                info['height'] = stream.codec_context.height
+            streams.append(info)
+        duration = container.duration / av.time_base if container.duration else 0
+    return {'streams': streams, 'format': {'duration': str(duration)}}
+
+async def probe_videos(paths, timeout: float = 5) -> dict:
+    """Probe several videos concurrently, returning {path: ffprobe JSON} for the ones that succeed"""
+    async def probe(path):
+        if av is not None:
+            try:
+                return await asyncio.to_thread(_av_probe, path)
+            except Exception:
+                pass  # Fall back to ffprobe for anything PyAV can't open
+        proc = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "quiet", "-print_format", "json",
+            "-show_entries", "stream=codec_type,codec_name,width,height:format=duration", str(path),
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        try:
+            stdout, _ = await proc.communicate()
+        except asyncio.CancelledError:
+            proc.kill()
+            raise
+        if proc.returncode != 0:
+            return None
+        return json.loads(stdout)
+    
+    paths = list(paths)
+    results = {}
+    try:
+        # One timeout for the whole batch rather than per file
+        probed = await asyncio.wait_for(asyncio.gather(*(probe(p) for p in paths), return_exceptions=True), timeout)
+    except asyncio.TimeoutError:
+        return results
+    for path, metadata in zip(paths, probed):
+        if isinstance(metadata, dict):
+            results[path] = metadata
+    return results
+
 def compress_video(input_file: Path, output_dir: Path, keep_audio: bool = False, progress_callback=None, 
-                   cpu_preset: str = "normal", cpu_threads: int = 0) -> Path:
+                   cpu_preset: str = "normal", cpu_threads: int = 0, encoder: str = "cpu") -> Path:
     output_dir.mkdir(parents=True, exist_ok=True)
     output_file = output_dir / f"{input_file.stem}_compressed.mp4"
     
@@ -30,23 +116,25 @@ def compress_video(input_file: Path, output_dir: Path, keep_audio: bool = False,
         print("    [!] Could not detect video duration, progress may not show")
     
     # Get CPU thread count
-    import multiprocessing
     max_threads = multiprocessing.cpu_count()
     threads = cpu_threads if cpu_threads > 0 else max_threads
     
     # Map friendly preset names to ffmpeg presets
-    from config import get_ffmpeg_preset
     ffmpeg_preset = get_ffmpeg_preset(cpu_preset)
     
-    # CPU encoding only
-    print(f"    Encoder: CPU ({threads}/{max_threads} threads, {cpu_preset} preset)")
-    cmd = [
-        "ffmpeg", "-y", "-i", str(input_file),
-        "-c:v", "libx264",
-        "-preset", ffmpeg_preset,
-        "-crf", str(FFMPEG_CRF),
-        "-threads", str(threads),
-    ]
+    hw_encoder = detect_hw_encoder() if encoder == "auto" else None
+    cmd = ["ffmpeg", "-y", "-i", str(input_file)]
+    if hw_encoder:
+        print(f"    Encoder: {hw_encoder} (hardware)")
+        cmd.extend(["-c:v", hw_encoder, *HW_ENCODERS[hw_encoder]])
+    else:
+        print(f"    Encoder: CPU ({threads}/{max_threads} threads, {cpu_preset} preset)")
+        cmd.extend([
+            "-c:v", "libx264",
+            "-preset", ffmpeg_preset,
+            "-crf", str(FFMPEG_CRF),
+            "-threads", str(threads),
+        ])
     
     # Audio codec
     if keep_audio:
@@ -64,44 +152,43 @@ def compress_video(input_file: Path, output_dir: Path, keep_audio: bool = False,
     
     print()
     
+    # Binary pipes: -progress prints a dozen key=value lines per update and only one matters,
+    # so lines are matched as bytes and never decoded
     process = subprocess.Popen(
         cmd, 
         stdout=subprocess.PIPE, 
-        stderr=subprocess.PIPE,
-        universal_newlines=True,
-        bufsize=1
+        stderr=subprocess.PIPE
     )
     
     last_percent = -1
     error_output = []
     
-    import threading
-    
     def read_stderr():
         for line in process.stderr:
-            error_output.append(line)
+            error_output.append(line.decode(errors='replace'))
     
     stderr_thread = threading.Thread(target=read_stderr, daemon=True)
     stderr_thread.start()
     
+    duration_us = duration * 1000000
     for line in process.stdout:
-        line = line.strip()
-        if line.startswith("out_time_ms="):
-            try:
-                time_ms = int(line.split("=")[1])
-                if duration > 0 and time_ms > 0:
-                    percent = min((time_ms / 1000000 / duration) * 100, 100.0)
-                    
-                    if int(percent) != int(last_percent):
-                        last_percent = percent
-                        
-                        if progress_callback:
-                            try:
-                                progress_callback(f"Compressing: {percent:.1f}% complete")
-                            except:
-                                pass
-            except:
-                pass
+        if not line.startswith(PROGRESS_PREFIX) or duration_us <= 0:
+            continue
+        try:
+            time_ms = int(line[len(PROGRESS_PREFIX):])  # int() skips the trailing newline itself
+        except ValueError:
+            continue  # out_time_ms=N/A before the first frame
+        if time_ms > 0:
+            percent = min(time_ms * 100 / duration_us, 100.0)
+            
+            if int(percent) != last_percent:
+                last_percent = int(percent)
+                
+                if progress_callback:
+                    try:
+                        progress_callback(f"Compressing: {percent:.1f}% complete")
+                    except:
+                        pass
     
     process.wait()
     
@@ -117,6 +204,9 @@ def compress_video(input_file: Path, output_dir: Path, keep_audio: bool = False,
             print(f"    [!] Error output:")
             for line in error_output[-10:]:
                 print(f"        {line.strip()}")
+        if hw_encoder:
+            print("    [!] Retrying on CPU")
+            return compress_video(input_file, output_dir, keep_audio, progress_callback, cpu_preset, cpu_threads, encoder="cpu")
         return None
     
     print(f"    Compressed: {get_file_size_gb(output_file):.2f} GB")
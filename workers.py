@@ -0,0 +1,49 @@
+"""Background job functions that run in worker processes"""
+from datetime import datetime
+
+from config import WORKSPACE_DIR
+from video import compress_video, get_file_size_gb
+
+
+# Workers can't touch the app's progress state directly, so they report through
+# an events queue: ('progress', job_id, msg) or ('log', job_id, msg, msg_type)
+
+def run_compress(files, keep_audio, cpu_preset, cpu_threads, encoder, job_id, events):
+    """Compress video files, returning a list of result dicts"""
+    results = []
+
+    def progress_callback(msg):
+        events.put(('progress', job_id, msg))
+
+    total_files = len(files)
+    for idx, filename in enumerate(files, 1):
+        filepath = WORKSPACE_DIR / filename
+        if not filepath.exists():
+            continue
+
+        # Create output folder
+        date_str = datetime.now().strftime('%Y%m%d')
+        counter = 1
+        while True:
+            folder_name = f"{date_str}_{filepath.stem}" if counter == 1 else f"{date_str}_{counter}_{filepath.stem}"
+            output_dir = WORKSPACE_DIR / folder_name
+            if not output_dir.exists():
+                break
+            counter += 1
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        events.put(('log', job_id, f'[{idx}/{total_files}] Compressing {filepath.name}...', 'info'))
+
+        compressed = compress_video(filepath, output_dir, keep_audio, progress_callback,
+                                    cpu_preset=cpu_preset, cpu_threads=cpu_threads, encoder=encoder)
+
+        if compressed:
+            events.put(('log', job_id, f'[OK] Compressed {filepath.name} → {compressed.name} ({round(get_file_size_gb(compressed), 2)} GB)', 'success'))
+            results.append({
+                'original': filename,
+                'compressed': str(compressed.relative_to(WORKSPACE_DIR)),
+                'size': round(get_file_size_gb(compressed), 2)
+            })
+
+    return results